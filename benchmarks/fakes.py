@@ -0,0 +1,223 @@
+"""
+Local stand-ins for the OpenAI and Pinecone endpoints the API calls.
+
+One server answers both: OpenAI routes under `/v1` (embeddings, chat
+completions with streaming and tool calls, moderations) and the Pinecone
+data-plane `/query`. Each route sleeps for its configured latency so the
+benchmark sees realistic waits without spending credits.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import zlib
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+WORDS = (
+    "survey household census health income employment education housing "
+    "population mobility retail transport deprivation wellbeing longitudinal "
+    "administrative linked records cohort local authority region ward"
+).split()
+
+
+def _rng(key: str) -> np.random.Generator:
+    return np.random.default_rng(zlib.crc32(key.encode()))
+
+
+def _embedding(key: str, dim: int) -> np.ndarray:
+    v = _rng(key).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def _text(rng: np.random.Generator, n_words: int) -> str:
+    return " ".join(rng.choice(WORDS, n_words))
+
+
+def _tokens(messages: list[dict]) -> int:
+    return sum(len(str(m.get("content") or "").split()) for m in messages)
+
+
+def create_app(
+    latency: dict[str, float],
+    dim: int = 1536,
+    n_datasets: int = 2000,
+    chunks_per_dataset: int = 4,
+    chunk_words: int = 400,
+) -> FastAPI:
+    app = FastAPI()
+    n_chunks = n_datasets * chunks_per_dataset
+    rng = _rng("corpus")
+    corpus = [
+        {
+            "id": f"ds-{i // chunks_per_dataset}",
+            "title": f"Dataset {i // chunks_per_dataset}",
+            "url": f"https://example.org/ds-{i // chunks_per_dataset}",
+            "source": ("ADR", "CDRC", "UKDS")[i % 3],
+            "date_created": "2020-01-01T00:00:00",
+            "context": _text(rng, chunk_words),
+        }
+        for i in range(n_chunks)
+    ]
+
+    @app.get("/health")
+    def health() -> dict[str, bool]:
+        return {"ok": True}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request) -> dict:
+        body = await request.json()
+        await asyncio.sleep(latency["embeddings"])
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for i, item in enumerate(inputs):
+            vector = _embedding(json.dumps(item), body.get("dimensions") or dim)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(item) if isinstance(item, list) else 1 for item in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body["model"],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.post("/v1/moderations")
+    async def moderations(request: Request) -> dict:
+        body = await request.json()
+        await asyncio.sleep(latency["moderation"])
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        return {
+            "id": "modr-bench",
+            "model": "text-moderation-bench",
+            "results": [
+                {"flagged": False, "categories": {}, "category_scores": {}}
+                for _ in inputs
+            ],
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        prompt_tokens = _tokens(body["messages"])
+        tools = body.get("tools")
+        if tools:
+            # structured output (the hallucination grader): answer every
+            # required field of the first tool with "yes"
+            function = tools[0]["function"]
+            required = function.get("parameters", {}).get("required", [])
+            tool_call = {
+                "id": "call_bench",
+                "type": "function",
+                "function": {
+                    "name": function["name"],
+                    "arguments": json.dumps({k: "yes" for k in required}),
+                },
+            }
+            tokens = ["yes"]
+        else:
+            text = _text(_rng(json.dumps(body["messages"])), 60)
+            tokens = [word + " " for word in text.split()]
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        base = {"id": "chatcmpl-bench", "created": 0, "model": body["model"]}
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency["chat"] + latency["token"] * len(tokens))
+            message = {"role": "assistant", "content": "".join(tokens).strip()}
+            if tools:
+                message = {"role": "assistant", "content": None}
+                message["tool_calls"] = [tool_call]
+            return base | {
+                "object": "chat.completion",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": message,
+                        "finish_reason": "tool_calls" if tools else "stop",
+                        "logprobs": None,
+                    }
+                ],
+                "usage": usage,
+            }
+
+        def chunk(delta: dict, finish_reason=None) -> str:
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+            payload = base | {"object": "chat.completion.chunk", "choices": [choice]}
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(latency["chat"])
+            if tools:
+                yield chunk(
+                    {"role": "assistant", "tool_calls": [tool_call | {"index": 0}]}
+                )
+            else:
+                for token in tokens:
+                    await asyncio.sleep(latency["token"])
+                    yield chunk({"role": "assistant", "content": token})
+            yield chunk({}, "tool_calls" if tools else "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/query")
+    async def query(request: Request) -> dict:
+        body = await request.json()
+        await asyncio.sleep(latency["pinecone"])
+        top_k = min(body.get("topK", 10), n_chunks)
+        rng = _rng(json.dumps(body.get("vector", [])[:8]))
+        chunks = rng.choice(n_chunks, top_k, replace=False)
+        # scores decay like a real dotproduct index: a few strong hits, then a tail
+        scores = 0.3 + 0.6 * np.exp(-np.arange(top_k) / max(top_k / 10, 1))
+        matches = []
+        for i, score in zip(chunks.tolist(), scores.tolist()):
+            match = {"id": str(i), "score": score, "values": []}
+            if body.get("includeMetadata"):
+                match["metadata"] = corpus[i]
+            matches.append(match)
+        return {
+            "matches": matches,
+            "namespace": body.get("namespace", ""),
+            "usage": {"readUnits": 5 + top_k // 100},
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--datasets", type=int, default=2000)
+    parser.add_argument("--embeddings-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--moderation-latency", type=float, default=0.1)
+    parser.add_argument("--pinecone-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    latency = {
+        "embeddings": args.embeddings_latency,
+        "chat": args.chat_latency,
+        "token": args.token_latency,
+        "moderation": args.moderation_latency,
+        "pinecone": args.pinecone_latency,
+    }
+    app = create_app(latency, dim=args.dim, n_datasets=args.datasets)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import random
+import timeit
+
+from langchain_core.documents import Document
+
+from src.model.grouping import group_chunks
+
+
+def _group_by_document_loop(documents):
+    grouped_id: dict[str, list[Document]] = {}
+
+    for d in documents:
+        id = d.metadata["id"]
+        if id not in grouped_id:
+            grouped_id[id] = []
+        grouped_id[id].append(d)
+
+    out_nodes = []
+    for doc in grouped_id.values():
+        content = "\n\n".join([d.page_content for d in doc])
+        scores = [d.metadata["score"] for d in doc]
+        document = Document(
+            page_content=content, metadata=doc[0].metadata | {"score": max(scores)}
+        )
+        out_nodes.append(document)
+    return out_nodes
+
+
+def make_chunks(n_chunks=500, n_datasets=150, chunk_chars=4000, seed=0):
+    rng = random.Random(seed)
+    scores = sorted((rng.random() for _ in range(n_chunks)), reverse=True)
+    return [
+        Document(
+            page_content="x" * chunk_chars,
+            metadata={
+                "id": f"dataset-{rng.randrange(n_datasets)}",
+                "title": "title",
+                "url": "https://example.org",
+                "score": score,
+            },
+        )
+        for score in scores
+    ]
+
+
+def main(number=200):
+    chunks = make_chunks()
+
+    expected = _group_by_document_loop(chunks)
+    actual = group_chunks(chunks, "max").to_documents()
+    assert [d.metadata for d in expected] == [d.metadata for d in actual]
+    assert [d.page_content for d in expected] == [d.page_content for d in actual]
+
+    cases = {
+        "loop (baseline)": lambda: _group_by_document_loop(chunks),
+        "vectorised, materialised": lambda: group_chunks(chunks).to_documents(),
+        "vectorised, ranking only": lambda: group_chunks(chunks),
+    } | {
+        f"vectorised, {agg}": lambda agg=agg: group_chunks(chunks, agg)
+        for agg in ("sum", "mean_top_m", "rrf")
+    }
+    for name, fn in cases.items():
+        seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        print(f"{name:<28} {seconds * 1e6:10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
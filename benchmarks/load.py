@@ -0,0 +1,309 @@
+"""
+Replay a query trace against the search API backed by local fakes.
+
+Boots `benchmarks.fakes` and `benchmarks.serve` as subprocesses, then runs one
+phase per endpoint at the requested concurrency and reports throughput,
+latency percentiles and the API process's resident memory. Caches start
+empty, so later phases see the hit rates real traffic would. The stream
+phase explains datasets the explain phase did not, so it measures token
+streaming rather than the explanation cache, and also reports time to first
+token. With `--baseline` the run fails if any endpoint's p95 latency or time to
+first token regressed by more than `--tolerance`.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+TRACE = Path(__file__).parent / "traces" / "queries.jsonl"
+ENDPOINTS = ("query", "explain", "stream")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_mb(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        return None
+    return None
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.02) -> None:
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak: float | None = None
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.is_set():
+            rss = _rss_mb(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0.0, rss)
+            time.sleep(self.interval)
+
+    def stop(self) -> float | None:
+        self._done.set()
+        self.join()
+        return self.peak
+
+
+def _wait_until(url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[2]} exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.25)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def load_trace(path: Path, n: int | None) -> list[str]:
+    with open(path) as f:
+        queries = [
+            (record.get("q") or record["query"])
+            for record in map(json.loads, filter(str.strip, f))
+        ]
+    if n is not None:
+        queries = [queries[i % len(queries)] for i in range(n)]
+    return queries
+
+
+async def run_phase(requests, concurrency: int, pid: int, ttft=None) -> dict:
+    """
+    `requests` are zero-argument coroutine factories returning a status code.
+
+    Streaming requests append their time to first token to `ttft`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(make_request):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                status = await make_request()
+            except httpx.HTTPError:
+                status = None
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+
+    rss_start = _rss_mb(pid)
+    sampler = MemorySampler(pid)
+    sampler.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(one(r) for r in requests))
+    elapsed = time.perf_counter() - start
+    rss_peak = sampler.stop()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    ttft_p50 = ttft_p95 = None
+    if ttft:
+        ttft_p50, ttft_p95 = (float(v) for v in np.percentile(ttft, [50, 95]) * 1000)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "ttft_p50_ms": ttft_p50,
+        "ttft_p95_ms": ttft_p95,
+        "rss_start_mb": rss_start,
+        "rss_peak_mb": rss_peak,
+        "rss_end_mb": _rss_mb(pid),
+    }
+
+
+async def replay(base_url: str, queries, endpoints, concurrency: int, pid: int):
+    report = {}
+    sessions = []
+    ttft = []
+    timeout = httpx.Timeout(120)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=timeout, limits=limits
+    ) as client:
+
+        def query(q):
+            async def request():
+                r = await client.post("/query", params={"q": q, "limit": 10})
+                if r.status_code == 200:
+                    sessions.append((q, r.json()["thread_id"]))
+                return r.status_code
+
+            return request
+
+        def explain(thread_id, docid):
+            async def request():
+                r = await client.get(f"/explain/{thread_id}", params={"docid": docid})
+                return r.status_code
+
+            return request
+
+        def stream(thread_id, docid):
+            async def request():
+                start = time.perf_counter()
+                async with client.stream(
+                    "GET", f"/explain/{thread_id}/stream", params={"docid": docid}
+                ) as r:
+                    async for line in r.aiter_lines():
+                        if line == "event: token" and start is not None:
+                            ttft.append(time.perf_counter() - start)
+                            start = None
+                    return r.status_code
+
+            return request
+
+        # /query always runs first since the other endpoints need its sessions
+        report["query"] = await run_phase([query(q) for q in queries], concurrency, pid)
+        if "explain" in endpoints and sessions:
+            report["explain"] = await run_phase(
+                [explain(t, 0) for _, t in sessions], concurrency, pid
+            )
+        if "stream" in endpoints and sessions:
+            # every request explains a (query, dataset) pair not seen before, so
+            # none is answered from the explanation cache
+            seen: dict[str, int] = {}
+            requests = []
+            for q, t in sessions:
+                seen[q] = seen.get(q, 0) + 1
+                requests.append(stream(t, seen[q]))
+            report["stream"] = await run_phase(requests, concurrency, pid, ttft)
+    return report
+
+
+def print_report(report: dict) -> None:
+    columns = ["requests", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms"]
+    columns += ["ttft_p50_ms", "ttft_p95_ms"]
+    columns += ["rss_start_mb", "rss_peak_mb", "rss_end_mb"]
+    print(f"{'endpoint':<10}" + "".join(f"{c:>14}" for c in columns))
+    for endpoint, row in report.items():
+        cells = [
+            (
+                "-"
+                if row.get(c) is None
+                else f"{row[c]:.1f}" if isinstance(row[c], float) else str(row[c])
+            )
+            for c in columns
+        ]
+        print(f"{endpoint:<10}" + "".join(f"{c:>14}" for c in cells))
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    failed = []
+    for endpoint, row in report.items():
+        if endpoint not in baseline:
+            continue
+        for metric in ("p95_ms", "ttft_p95_ms"):
+            before, after = baseline[endpoint].get(metric), row.get(metric)
+            if before is not None and after is not None:
+                if after > before * (1 + tolerance):
+                    failed.append(f"{endpoint}: {metric} {before:.1f} -> {after:.1f}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--trace", type=Path, default=TRACE)
+    parser.add_argument("-n", "--requests", type=int, default=None)
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--embeddings-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--moderation-latency", type=float, default=0.1)
+    parser.add_argument("--pinecone-latency", type=float, default=0.05)
+    parser.add_argument("--output", type=Path, help="write the report as JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON report to compare p95 to")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    fakes_port, api_port = _free_port(), _free_port()
+    fakes_url = f"http://127.0.0.1:{fakes_port}"
+    env = os.environ | {
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{fakes_url}/v1",
+        "OPENAI_API_BASE": f"{fakes_url}/v1",
+        "PINECONE_API_KEY": "bench",
+    }
+    latency_args = [
+        f"--{name}-latency={getattr(args, f'{name}_latency')}"
+        for name in ("embeddings", "chat", "token", "moderation", "pinecone")
+    ]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fakes = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.fakes", f"--port={fakes_port}"]
+            + latency_args,
+            env=env,
+        )
+        api = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.serve",
+                f"--port={api_port}",
+                f"--pinecone={fakes_url}",
+                f"--cache-dir={cache_dir}",
+            ],
+            env=env,
+        )
+        try:
+            _wait_until(f"{fakes_url}/health", fakes, timeout=60)
+            _wait_until(f"http://127.0.0.1:{api_port}/ready", api, timeout=120)
+            report = asyncio.run(
+                replay(
+                    f"http://127.0.0.1:{api_port}",
+                    load_trace(args.trace, args.requests),
+                    args.endpoints,
+                    args.concurrency,
+                    api.pid,
+                )
+            )
+        finally:
+            api.terminate()
+            fakes.terminate()
+            api.wait()
+            fakes.wait()
+
+    print_report(report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        failed = regressions(
+            report, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for line in failed:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Micro-benchmarks for the CPU-bound steps of search and indexing.
+
+Covers `_group_by_document`, `clean_string` and reading the per-source
+document stores. The stores are synthetic Parquet tables written to a
+scratch directory, so no real catalogue data is needed.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import timeit
+from pathlib import Path
+
+from benchmarks.grouping import make_chunks
+from src.common.utils import clean_string
+from src.datastore.documents import read_documents, write_documents
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+
+def make_html(paragraphs=50, seed=0) -> str:
+    rng = random.Random(seed)
+    words = "data survey census health income housing region cohort".split()
+    blocks = []
+    for _ in range(paragraphs):
+        sentence = " ".join(rng.choice(words) for _ in range(60))
+        blocks.append(f"<p>  {sentence}\t\t</p>\n/* comment */\n \n")
+    return "".join(blocks)
+
+
+def write_catalogue(root: Path, n_documents: int, seed=0) -> dict[str, Path]:
+    """Write ADR, UKDS and CDRC document stores laid out as the assets do."""
+    rng = random.Random(seed)
+    text = clean_string(make_html(10, seed))
+    stores = {}
+    for name in ("adr", "ukds", "cdrc"):
+        (root / name).mkdir(parents=True)
+        stores[name] = root / name / f"{name}_documents.parquet"
+        write_documents(
+            [
+                {
+                    "id": str(i),
+                    "text": text,
+                    "title": f"{name.upper()} {i}",
+                    "url": f"https://example.org/{name}/{i}",
+                    "date": f"{rng.randint(2000, 2024)}-01-{rng.randint(1, 28):02d}",
+                    "source": name.upper(),
+                }
+                for i in range(n_documents)
+            ],
+            stores[name],
+        )
+    return stores
+
+
+def timed(fn, number: int, repeat: int = 5) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--documents", type=int, default=200)
+    args = parser.parse_args()
+
+    from src.model.model import _group_by_document
+
+    chunks = make_chunks(n_chunks=args.chunks)
+    html = make_html()
+    results = {
+        f"_group_by_document ({args.chunks} chunks)": timed(
+            lambda: _group_by_document(chunks), number=100
+        ),
+        f"clean_string ({len(html) // 1024} KiB)": timed(
+            lambda: clean_string(html), number=100
+        ),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, path in write_catalogue(Path(tmp), args.documents).items():
+            results[f"read_documents {name} ({args.documents} docs)"] = timed(
+                lambda path=path: sum(1 for _ in read_documents(path)),
+                number=1,
+                repeat=3,
+            )
+
+    for name, seconds in results.items():
+        print(f"{name:<40} {seconds * 1e3:10.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
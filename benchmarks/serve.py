@@ -0,0 +1,32 @@
+"""Run the search API against the benchmark fakes, with caches in a scratch dir."""
+
+import argparse
+from pathlib import Path
+
+import uvicorn
+
+from src.common.settings import cfg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--pinecone", required=True, help="fake Pinecone index URL")
+    parser.add_argument("--cache-dir", required=True)
+    args = parser.parse_args()
+
+    # settings are read from config.toml, so point them at the fakes here
+    # before the app module builds its retriever
+    cfg.datastore.backend = "pinecone"
+    cfg.datastore.host = args.pinecone
+    cfg.cache.disk_path = str(Path(args.cache_dir) / "cache.sqlite")
+    cfg.api.session_path = str(Path(args.cache_dir) / "sessions.sqlite")
+
+    uvicorn.run(
+        "src.search_api.api:app", host=args.host, port=args.port, log_level="warning"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import tomllib
+from typing import Literal
 
 from pydantic import Field
 from pydantic_settings import BaseSettings
@@ -14,17 +15,66 @@ class DataStoreSettings(BaseSettings):
     embed_dim: int = Field(gt=0, le=10_000)
     chunk_size: int = Field(gt=0, le=10_000)
     chunk_overlap: int = Field(ge=0, le=10_000)
+    backend: Literal["pinecone", "local"] = "pinecone"
+    local_path: str = Field(default="index", min_length=1)
+    local_quantize: bool = False
+    sync: Literal["incremental", "full"] = "incremental"
+    embedding_cache: str = "data/embeddings.sqlite"
+    load_workers: int = Field(default=8, gt=0)
+    embed_batch_size: int = Field(default=256, gt=0, le=2048)
+    embed_workers: int = Field(default=4, gt=0)
+    embed_tokens_per_minute: int = Field(default=1_000_000, gt=0)
 
 
 class ModelSettings(BaseSettings):
     llm: str = Field(min_length=1)
     top_k: int = Field(gt=0, le=15_000)
     alpha: float = Field(ge=0.0, le=1.0)
+    concurrent_checks: bool = True
+    aggregation: Literal["max", "sum", "mean_top_m", "rrf"] = "max"
+    top_m: int = Field(default=3, gt=0)
+    rrf_k: int = Field(default=60, ge=0)
+    two_stage: bool = False
+    first_stage_k: int = Field(default=100, gt=0, le=15_000)
+    reranker: Literal["bm25"] = "bm25"
+    rerank_budget_ms: float = Field(default=50, gt=0)
+    adaptive: bool = False
+    adaptive_start_k: int = Field(default=50, gt=0)
+    adaptive_score_ratio: float = Field(default=0.5, ge=0, le=1)
+    adaptive_min_new_ids: float = Field(default=0.1, ge=0)
+    explain_token_budget: int = Field(default=2000, gt=0)
+
+
+class ApiSettings(BaseSettings):
+    max_connections: int = Field(gt=0, le=10_000)
+    pool_threads: int = Field(gt=0, le=1_000)
+    session_backend: Literal["memory", "sqlite"]
+    session_path: str = Field(min_length=1)
+    session_maxsize: int = Field(gt=0, le=1_000_000)
+    session_ttl: float = Field(gt=0)
+    explain_concurrency: int = Field(gt=0, le=100)
+    snippet_chars: int = Field(gt=0, le=100_000)
+
+
+class CacheSettings(BaseSettings):
+    ttl: float = Field(gt=0)
+    disk_path: str = ""
+    embeddings_maxsize: int = Field(gt=0, le=1_000_000)
+    embeddings_disk_maxsize: int = Field(default=100_000, gt=0, le=10_000_000)
+    results_maxsize: int = Field(gt=0, le=100_000)
+    results_disk_maxsize: int = Field(default=500, gt=0, le=1_000_000)
+    explanations_maxsize: int = Field(gt=0, le=1_000_000)
+    explanations_disk_maxsize: int = Field(default=100_000, gt=0, le=10_000_000)
+    semantic: bool = False
+    semantic_maxsize: int = Field(gt=0, le=1_000_000)
+    semantic_threshold: float = Field(gt=0.0, le=1.0)
 
 
 class Settings(BaseSettings):
     model: ModelSettings = ModelSettings.model_validate(Config["model"])
     datastore: DataStoreSettings = DataStoreSettings.model_validate(Config["datastore"])
+    api: ApiSettings = ApiSettings.model_validate(Config["api"])
+    cache: CacheSettings = CacheSettings.model_validate(Config["cache"])
 
 
 cfg = Settings()
@@ -11,6 +11,7 @@ class Paths:
     ADR = DATA / "adr"
     UKDS = DATA / "ukds"
     CDRC = DATA / "cdrc"
+    BM25 = Path("bm25")
 
     @classmethod
     def ensure_directories_exist(cls):
@@ -8,6 +8,7 @@ from tenacity import retry, stop_after_attempt, wait_exponential
 from tqdm import tqdm
 
 from src.common.utils import Paths, clean_string
+from src.datastore.documents import iso_date, write_documents
 
 PAGE_SIZE = 100
 API_VERSION = "2.0"
@@ -122,14 +123,17 @@ def _fetch_dataset_info(
 
 @asset
 def adr_descriptions(adr_datasets: pl.DataFrame) -> None:
-    outdir = Paths.ADR / "txt"
-    outdir.mkdir(parents=True, exist_ok=True)
-    for file in outdir.glob("*.txt"):
-        file.unlink()
-
-    for item in adr_datasets.rows(named=True):
-        with open(
-            outdir / f"{item['id']}-{item['origin_id']}-description.txt",
-            "w",
-        ) as f:
-            f.write(clean_string(f"{item['description']}\n{item['abstract']}"))
+    write_documents(
+        [
+            {
+                "id": f"{item['id']}-{item['origin_id']}",
+                "text": clean_string(f"{item['description']}\n{item['abstract']}"),
+                "title": item["name"],
+                "url": item["url"],
+                "date": iso_date(item["publication_date"]),
+                "source": "ADR",
+            }
+            for item in adr_datasets.rows(named=True)
+        ],
+        Paths.ADR / "adr_documents.parquet",
+    )
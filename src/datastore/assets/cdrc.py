@@ -9,6 +9,7 @@ from dotenv import load_dotenv
 from tqdm import tqdm
 
 from src.common.utils import Paths, clean_string
+from src.datastore.documents import iso_date, write_documents
 
 load_dotenv()
 
@@ -35,17 +36,23 @@ def cdrc_metadata(context: AssetExecutionContext) -> list[dict]:
 
 @asset
 def cdrc_notes(cdrc_metadata: list[dict]):
-    outdir = Paths.CDRC / "txt"
-    outdir.mkdir(parents=True, exist_ok=True)
-    for file in outdir.glob("*.txt"):
-        file.unlink()
-
     df = pl.DataFrame(cdrc_metadata).drop(["resources", "tags", "extras"])
     df.write_parquet(Paths.CDRC / "cdrc_metadata.parquet")
 
-    for item in df.rows(named=True):
-        with open(Paths.CDRC / "txt" / f"{item['id']}-notes.txt", "w") as f:
-            f.write(clean_string(item["notes"]))
+    write_documents(
+        [
+            {
+                "id": item["id"],
+                "text": clean_string(item["notes"]),
+                "title": item["title"],
+                "url": item["url"],
+                "date": iso_date(item["metadata_created"]),
+                "source": "CDRC",
+            }
+            for item in df.rows(named=True)
+        ],
+        Paths.CDRC / "cdrc_documents.parquet",
+    )
 
 
 @asset
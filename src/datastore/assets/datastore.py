@@ -1,4 +1,9 @@
+import hashlib
+import json
+import os
 import time
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timezone
 from pathlib import Path
 
 from dagster import (
@@ -8,49 +13,53 @@ from dagster import (
     asset,
 )
 from dagster_openai import OpenAIResource
-from langchain_community.document_loaders import DirectoryLoader
 from langchain_core.documents import Document
 from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
 from langchain_text_splitters import TokenTextSplitter
 from pinecone import Pinecone, ServerlessSpec
 from pinecone_text.sparse import BM25Encoder
 
 from src.common.settings import cfg
 from src.common.utils import Paths
-from src.datastore.loaders import ADRLoader, CDRCLoader, UKDSLoader
+from src.datastore.documents import read_documents
+from src.datastore.loaders import CDRCLoader
+from src.datastore.pipeline import TokenRateLimiter, embed_batches, iter_documents
+from src.model.bm25 import BM25Accumulator, write_bm25_binary
+from src.model.cache import DocumentEmbeddingCache
+from src.model.context import chunk_spans, encode_spans, encoding_for
+from src.model.local_index import LocalIndexWriter
 
 wait_on_all_parents_policy = AutoMaterializePolicy.eager().with_rules(
     AutoMaterializeRule.skip_on_not_all_parents_updated()
 )
+MANIFEST = Paths.BM25 / "index_manifest.json"
+DELETE_BATCH = 1000
+UPSERT_BATCH = 32
 
 
-def _process_documents(
-    paths: list[Path],
-    glob_patterns: list[str],
-    loader_classes: list[type],
-) -> list[Document]:
-    documents = []
-    for path, glob_pattern, loader_cls in zip(paths, glob_patterns, loader_classes):
-        loader = DirectoryLoader(
-            str(path),
-            glob=glob_pattern,
-            loader_cls=loader_cls,
-            use_multithreading=True,
-            show_progress=True,
-        )
-        documents.extend(loader.load())
-    return [
-        doc for doc in documents if "id" in doc.metadata and len(doc.page_content) > 10
-    ]
+def _write_json(path: Path, payload: dict) -> None:
+    # readers may open the file at any time, so never expose a partial write
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
 
 
-@asset(
-    compute_kind="Pinecone",
-    deps=["adr_descriptions", "ukds_abstracts", "cdrc_notes", "cdrc_pdfs"],
-    auto_materialize_policy=wait_on_all_parents_policy,
-)
-def pinecone_index(context: AssetExecutionContext, openai: OpenAIResource):
+def _write_index_version(version: str, n_chunks: int) -> None:
+    _write_json(
+        Paths.BM25 / "index_version.json",
+        {
+            "version": version,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "n_chunks": n_chunks,
+        },
+    )
+
+
+def _recreate_pinecone_index() -> None:
+    # the manifest describes the old index; a run that fails before writing a
+    # new one must not let the next run skip chunks the new index lacks
+    MANIFEST.unlink(missing_ok=True)
     pc = Pinecone()
     if cfg.datastore.index_name in [index["name"] for index in pc.list_indexes()]:
         pc.delete_index(cfg.datastore.index_name)
@@ -64,45 +73,197 @@ def pinecone_index(context: AssetExecutionContext, openai: OpenAIResource):
     while not pc.describe_index(cfg.datastore.index_name).status["ready"]:
         time.sleep(1)
 
-    documents = (
-        _process_documents(
-            paths=[Paths.ADR / "txt"],
-            glob_patterns=["*.txt"],
-            loader_classes=[ADRLoader],
-        )
-        + _process_documents(
-            paths=[Paths.CDRC / "txt", Paths.CDRC / "pdf"],
-            glob_patterns=["*.txt", "*.pdf"],
-            loader_classes=[CDRCLoader, CDRCLoader],
-        )
-        + _process_documents(
-            paths=[Paths.UKDS / "txt"],
-            loader_classes=[UKDSLoader],
-            glob_patterns=["*.txt"],
-        )
+
+def _identify(chunks: Iterable[Document]) -> Iterator[tuple[str, str, Document]]:
+    """Stable `{dataset id}-{source file hash}-{n}` chunk IDs, with content hashes."""
+    counts: dict[str, int] = {}
+    for chunk in chunks:
+        source = Path(chunk.metadata["file_path"]).name
+        key = f"{chunk.metadata['id']}-{hashlib.sha1(source.encode()).hexdigest()[:12]}"
+        n = counts.get(key, 0)
+        counts[key] = n + 1
+        yield f"{key}-{n}", _content_hash(chunk), chunk
+
+
+def _content_hash(doc: Document) -> str:
+    payload = doc.page_content + "\0" + json.dumps(doc.metadata, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _read_manifest() -> dict[str, str] | None:
+    if not MANIFEST.exists():
+        return None
+    manifest = json.loads(MANIFEST.read_text())
+    index = (
+        cfg.datastore.index_name,
+        cfg.datastore.embed_model,
+        cfg.datastore.embed_dim,
+    )
+    if (
+        manifest["index_name"],
+        manifest["embed_model"],
+        manifest["embed_dim"],
+    ) != index:
+        return None
+    return manifest["chunks"]
+
+
+def _write_manifest(chunks: dict[str, str]) -> None:
+    _write_json(
+        MANIFEST,
+        {
+            "index_name": cfg.datastore.index_name,
+            "embed_model": cfg.datastore.embed_model,
+            "embed_dim": cfg.datastore.embed_dim,
+            "chunks": chunks,
+        },
     )
 
-    with openai.get_client(context) as client:
-        embeddings = OpenAIEmbeddings(
-            client=client.embeddings, model=cfg.datastore.embed_model
-        )
 
+def _prepare_pinecone_index(context: AssetExecutionContext) -> dict[str, str]:
+    """Manifest of chunks already in the index, recreating it when there is none."""
+    pc = Pinecone()
+    exists = cfg.datastore.index_name in [i["name"] for i in pc.list_indexes()]
+    manifest = _read_manifest() if cfg.datastore.sync == "incremental" else None
+    if manifest is None or not exists:
+        context.log.info("Rebuilding Pinecone index from scratch")
+        _recreate_pinecone_index()
+        return {}
+    return manifest
+
+
+def _iter_chunks(documents: Iterable[Document]) -> Iterator[Document]:
     text_splitter = TokenTextSplitter(
         chunk_size=cfg.datastore.chunk_size,
         chunk_overlap=cfg.datastore.chunk_overlap,
     )
-    documents = text_splitter.split_documents(documents)
+    for document in documents:
+        for doc in text_splitter.split_documents([document]):
+            doc.page_content = (
+                f"Dataset Title: {doc.metadata["title"]}\n\n{doc.page_content}"
+            )
+            # snippet boundaries and token counts used to budget explanation prompts
+            doc.metadata["spans"] = encode_spans(chunk_spans(doc.page_content))
+            yield doc
+
+
+DOCUMENT_STORES = [
+    Paths.ADR / "adr_documents.parquet",
+    Paths.CDRC / "cdrc_documents.parquet",
+    Paths.UKDS / "ukds_documents.parquet",
+]
+SOURCES = [(Paths.CDRC / "pdf", "*.pdf", CDRCLoader)]
+
+
+def _load_documents() -> Iterator[Document]:
+    for path in DOCUMENT_STORES:
+        yield from read_documents(path)
+    yield from iter_documents(SOURCES, workers=cfg.datastore.load_workers)
+
 
-    for doc in documents:
-        doc.page_content = (
-            f"Dataset Title: {doc.metadata["title"]}\n\n{doc.page_content}"
+@asset(
+    compute_kind="Pinecone",
+    deps=["adr_descriptions", "ukds_abstracts", "cdrc_notes", "cdrc_pdfs"],
+    auto_materialize_policy=wait_on_all_parents_policy,
+)
+def pinecone_index(context: AssetExecutionContext, openai: OpenAIResource):
+    with openai.get_client(context) as client:
+        embeddings = OpenAIEmbeddings(
+            client=client.embeddings, model=cfg.datastore.embed_model
+        )
+    if cfg.datastore.embedding_cache:
+        embeddings = DocumentEmbeddingCache(
+            embeddings,
+            path=cfg.datastore.embedding_cache,
+            model=cfg.datastore.embed_model,
+            dim=cfg.datastore.embed_dim,
+        )
+
+    local = cfg.datastore.backend == "local"
+    manifest = {} if local else _prepare_pinecone_index(context)
+    index = None if local else Pinecone().Index(cfg.datastore.index_name)
+
+    bm25 = BM25Accumulator(BM25Encoder())
+    chunks: dict[str, str] = {}
+    writer = None
+    if local:
+        writer = LocalIndexWriter(
+            cfg.datastore.local_path,
+            version=context.run_id,
+            dim=cfg.datastore.embed_dim,
+            quantize=cfg.datastore.local_quantize,
+        )
+
+    def changed_chunks():
+        for id, digest, chunk in _identify(_iter_chunks(_load_documents())):
+            bm25.add(chunk.page_content)
+            chunks[id] = digest
+            if manifest.get(id) != digest:
+                yield id, chunk
+
+    start = time.perf_counter()
+    n_upserted = n_tokens = 0
+    for batch, vectors, batch_tokens in embed_batches(
+        changed_chunks(),
+        embeddings,
+        batch_size=cfg.datastore.embed_batch_size,
+        workers=cfg.datastore.embed_workers,
+        limiter=TokenRateLimiter(cfg.datastore.embed_tokens_per_minute),
+        encoding=encoding_for(cfg.datastore.embed_model),
+    ):
+        if writer is not None:
+            writer.add(
+                vectors,
+                contexts=[doc.page_content for _, doc in batch],
+                metadatas=[doc.metadata for _, doc in batch],
+            )
+        else:
+            index.upsert(
+                vectors=[
+                    {
+                        "id": id,
+                        "values": vector,
+                        "metadata": doc.metadata | {"context": doc.page_content},
+                    }
+                    for (id, doc), vector in zip(batch, vectors)
+                ],
+                batch_size=UPSERT_BATCH,
+            )
+        n_upserted += len(batch)
+        n_tokens += batch_tokens
+        elapsed = time.perf_counter() - start
+        context.log.info(
+            f"Embedded {n_upserted} chunks "
+            f"({n_upserted / elapsed:.1f} chunks/s, {n_tokens / elapsed:.0f} tokens/s)"
         )
+    elapsed = time.perf_counter() - start
+
+    bm25_encoder = bm25.finish()
+    bm25_values = Paths.BM25 / "bm25_values.json"
+    bm25_encoder.dump(str(bm25_values.with_suffix(".tmp")))
+    os.replace(bm25_values.with_suffix(".tmp"), bm25_values)
+    write_bm25_binary(bm25_encoder.get_params(), Paths.BM25 / "bm25.bin")
+
+    removed = sorted(manifest.keys() - chunks.keys())
+    if writer is not None:
+        writer.finish(bm25_encoder)
+    else:
+        for i in range(0, len(removed), DELETE_BATCH):
+            index.delete(ids=removed[i : i + DELETE_BATCH])
+        # only record the new state once Pinecone has accepted it
+        _write_manifest(chunks)
 
-    bm25_encoder = BM25Encoder()
-    bm25_encoder.fit([doc.page_content for doc in documents])
-    bm25_encoder.dump("bm25/bm25_values.json")
+    metadata = {
+        "n_upserted": n_upserted,
+        "n_deleted": len(removed),
+        "chunks_per_s": n_upserted / elapsed if elapsed else 0.0,
+        "tokens_per_s": n_tokens / elapsed if elapsed else 0.0,
+    }
+    if isinstance(embeddings, DocumentEmbeddingCache):
+        metadata |= embeddings.stats()
+        context.log.info(f"Embedding cache: {embeddings.stats()}")
 
-    vectorstore = PineconeVectorStore(
-        index_name=cfg.datastore.index_name, embedding=embeddings, text_key="context"
+    _write_index_version(context.run_id, n_chunks=len(chunks))
+    context.add_output_metadata(
+        {"index_version": context.run_id, "n_chunks": len(chunks)} | metadata
     )
-    vectorstore.add_documents(documents=documents)
@@ -8,6 +8,7 @@ from tenacity import retry, stop_after_attempt, wait_exponential
 from tqdm import tqdm
 
 from src.common.utils import Paths, clean_string
+from src.datastore.documents import iso_date, write_documents
 
 BASE_URL = "https://oai.ukdataservice.ac.uk:8443/oai/provider"
 PARAMS = {"verb": "ListIdentifiers", "metadataPrefix": "ddi", "set": "DataCollections"}
@@ -109,16 +110,20 @@ def ukds_datasets(
 
 @asset
 def ukds_abstracts(ukds_datasets: pl.DataFrame):
-    outdir = Paths.UKDS / "txt"
-    outdir.mkdir(parents=True, exist_ok=True)
-    for file in outdir.glob("*.txt"):
-        file.unlink()
-
+    documents = []
     for row in ukds_datasets.rows(named=True):
-        id = row["url"].split("=")[-1]
         abstract = row["abstract"].replace(
             "Abstract copyright UK Data Service and data collection copyright owner.",
             "",
         )
-        with open(outdir / f"{id}-abstract.txt", "w") as f:
-            f.write(clean_string(abstract))
+        documents.append(
+            {
+                "id": row["url"].split("=")[-1],
+                "text": clean_string(abstract),
+                "title": row["title"],
+                "url": row["url"],
+                "date": iso_date(row["date"]),
+                "source": "UKDS",
+            }
+        )
+    write_documents(documents, Paths.UKDS / "ukds_documents.parquet")
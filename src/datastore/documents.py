@@ -0,0 +1,55 @@
+import functools
+from pathlib import Path
+from typing import Iterator
+
+import dateparser
+import polars as pl
+from langchain_core.documents import Document
+
+SCHEMA = {
+    "id": pl.String,
+    "text": pl.String,
+    "title": pl.String,
+    "url": pl.String,
+    "date": pl.String,
+    "source": pl.String,
+}
+
+
+@functools.cache
+def iso_date(date: str | None) -> str:
+    if not isinstance(date, str):
+        return ""
+    return dateparser.parse(date).isoformat()  # type: ignore
+
+
+def write_documents(rows: list[dict[str, str]], path: Path) -> pl.DataFrame:
+    """Write one source's documents as a single Parquet table with `SCHEMA`."""
+    df = pl.DataFrame(rows, schema=SCHEMA).filter(
+        pl.col("id").is_not_null() & (pl.col("text").str.len_chars() > 10)
+    )
+    df.write_parquet(path)
+    return df
+
+
+def read_documents(path: Path, batch_size: int = 1000) -> Iterator[Document]:
+    """
+    Documents of a table written by `write_documents`.
+
+    The file is memory-mapped and walked in zero-copy slices, so only one
+    batch of rows is turned into Python objects at a time.
+    """
+    df = pl.read_parquet(path, memory_map=True)
+    for batch in df.iter_slices(batch_size):
+        for row in batch.iter_rows(named=True):
+            yield Document(
+                page_content=row["text"],
+                metadata={
+                    "title": row["title"],
+                    "id": row["id"],
+                    "url": row["url"],
+                    "date_created": row["date"],
+                    "source": row["source"],
+                    "file_path": str(path),
+                },
+            )
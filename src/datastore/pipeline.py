@@ -0,0 +1,107 @@
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import batched
+from pathlib import Path
+
+import tiktoken
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from src.model.context import count_tokens
+
+
+def iter_documents(
+    sources: list[tuple[Path, str, type]], workers: int = 8
+) -> Iterator[Document]:
+    """
+    Lazily load `(directory, glob, loader class)` sources on a thread pool.
+
+    Unlike `DirectoryLoader(use_multithreading=True)`, at most `2 * workers`
+    files are in flight, so memory does not grow with the number of files.
+    """
+
+    def load(loader_cls: type, path: Path) -> list[Document]:
+        return list(loader_cls(str(path)).lazy_load())
+
+    with ThreadPoolExecutor(workers) as pool:
+        for directory, glob, loader_cls in sources:
+            files = iter(sorted(directory.glob(glob)))
+            pending = [
+                pool.submit(load, loader_cls, path)
+                for path in _take(files, 2 * workers)
+            ]
+            while pending:
+                documents = pending.pop(0).result()
+                pending.extend(
+                    pool.submit(load, loader_cls, path) for path in _take(files, 1)
+                )
+                for doc in documents:
+                    if "id" in doc.metadata and len(doc.page_content) > 10:
+                        yield doc
+
+
+def _take(iterator: Iterator, n: int) -> list:
+    return [item for _, item in zip(range(n), iterator)]
+
+
+class TokenRateLimiter:
+    """Token bucket shared by embedding workers, refilled at `tokens_per_minute`."""
+
+    def __init__(self, tokens_per_minute: int) -> None:
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: int) -> None:
+        n = min(n, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait_for = (n - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+def embed_batches(
+    items: Iterable[tuple[str, Document]],
+    embeddings: Embeddings,
+    batch_size: int,
+    workers: int,
+    limiter: TokenRateLimiter,
+    encoding: tiktoken.Encoding,
+) -> Iterator[tuple[list[tuple[str, Document]], list[list[float]], int]]:
+    """
+    Embed `(id, chunk)` pairs in batches on `workers` threads.
+
+    Yields `(batch, vectors, n_tokens)` as each batch finishes, in completion
+    order. Only `2 * workers` batches are queued, so `items` is consumed at the
+    pace the API allows. Tokens are counted with `encoding`, which should be the
+    embedding model's, as that is what the rate limit is charged in.
+    """
+
+    def embed(batch):
+        texts = [doc.page_content for _, doc in batch]
+        n_tokens = sum(count_tokens(text, encoding) for text in texts)
+        limiter.acquire(n_tokens)
+        return batch, embeddings.embed_documents(texts), n_tokens
+
+    with ThreadPoolExecutor(workers) as pool:
+        pending = set()
+        for batch in batched(items, batch_size):
+            pending.add(pool.submit(embed, batch))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (future.result() for future in done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from (future.result() for future in done)
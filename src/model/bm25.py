@@ -0,0 +1,122 @@
+import json
+import os
+from collections import Counter
+from collections.abc import Iterator, Mapping
+from pathlib import Path
+
+import numpy as np
+from pinecone_text.sparse import BM25Encoder
+
+MAGIC = b"BM25BIN1"
+LOAD_FACTOR = 0.7
+
+
+def write_bm25_binary(params: dict, path: str | Path) -> None:
+    """
+    Write `BM25Encoder.get_params()` as a header plus an open-addressing table.
+
+    Term hashes and document frequencies are two parallel arrays sized to a
+    power of two; an empty slot has a document frequency of zero.
+    """
+    indices = np.asarray(params["doc_freq"]["indices"], dtype=np.uint32)
+    values = np.asarray(params["doc_freq"]["values"], dtype=np.float32)
+
+    size = 1 << max(int(np.ceil(np.log2(max(len(indices), 1) / LOAD_FACTOR))), 1)
+    mask = size - 1
+    keys = np.zeros(size, dtype=np.uint32)
+    freqs = np.zeros(size, dtype=np.float32)
+    for key, freq in zip(indices.tolist(), values.tolist()):
+        slot = key & mask
+        while freqs[slot] != 0:
+            slot = (slot + 1) & mask
+        keys[slot] = key
+        freqs[slot] = freq
+
+    header = json.dumps(
+        {k: v for k, v in params.items() if k != "doc_freq"} | {"table_size": size}
+    ).encode()
+    offset = len(MAGIC) + 4 + len(header)
+    padding = -offset % 8
+    # API workers memory-map the file, so replace it rather than truncating it
+    tmp = Path(f"{path}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint32(len(header) + padding).tobytes())
+        f.write(header + b" " * padding)
+        f.write(keys.tobytes())
+        f.write(freqs.tobytes())
+    os.replace(tmp, path)
+
+
+class HashedDocFreq(Mapping):
+    """Read-only term hash -> document frequency view over memory-mapped arrays."""
+
+    def __init__(self, keys: np.ndarray, freqs: np.ndarray) -> None:
+        self.keys = keys
+        self.freqs = freqs
+        self.mask = len(keys) - 1
+
+    def __getitem__(self, key: int) -> float:
+        slot = key & self.mask
+        while (freq := self.freqs[slot]) != 0:
+            if self.keys[slot] == key:
+                return float(freq)
+            slot = (slot + 1) & self.mask
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.keys[self.freqs != 0].tolist())
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.freqs))
+
+
+class BinaryBM25Encoder(BM25Encoder):
+    """
+    BM25 encoder backed by the binary format from `write_bm25_binary`.
+
+    The table is memory-mapped, so uvicorn workers share the same pages and
+    startup does not parse any JSON. Encoding is inherited unchanged.
+    """
+
+    def load(self, path: str | Path) -> "BinaryBM25Encoder":
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a binary BM25 file")
+            header_len = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+            params = json.loads(f.read(header_len))
+
+        size = params.pop("table_size")
+        offset = len(MAGIC) + 4 + header_len
+        keys = np.memmap(path, dtype=np.uint32, mode="r", offset=offset, shape=(size,))
+        freqs = np.memmap(
+            path, dtype=np.float32, mode="r", offset=offset + 4 * size, shape=(size,)
+        )
+
+        self.set_params(**params, doc_freq={"indices": [], "values": []})
+        self.doc_freq = HashedDocFreq(keys, freqs)
+        return self
+
+
+class BM25Accumulator:
+    """Streaming equivalent of `BM25Encoder.fit`, fed one chunk at a time."""
+
+    def __init__(self, encoder: BM25Encoder) -> None:
+        self.encoder = encoder
+        self.n_docs = 0
+        self.sum_doc_len = 0
+        self.doc_freq: Counter = Counter()
+
+    def add(self, text: str) -> None:
+        indices, tf = self.encoder._tf(text)
+        if len(indices) == 0:
+            return
+        self.n_docs += 1
+        self.sum_doc_len += sum(tf)
+        self.doc_freq.update(indices)
+
+    def finish(self) -> BM25Encoder:
+        self.encoder.doc_freq = dict(self.doc_freq)
+        self.encoder.n_docs = self.n_docs
+        self.encoder.avgdl = self.sum_doc_len / self.n_docs
+        return self.encoder
@@ -0,0 +1,425 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.common.settings import cfg
+from src.common.utils import Paths
+
+
+def normalise_query(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class TTLCache:
+    """Thread-safe in-memory LRU cache where entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+
+class SQLiteCache:
+    """
+    JSON values in a SQLite table, shared across processes and restarts.
+
+    With `dtype` set, values are arrays stored as raw blobs of that type.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        table: str,
+        ttl: float,
+        maxsize: int | None = None,
+        dtype: np.dtype | type | None = None,
+    ) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            f"(key TEXT PRIMARY KEY, value {'TEXT' if dtype is None else 'BLOB'} "
+            "NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table} (expires)"
+        )
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+        if self.dtype is not None:
+            return np.frombuffer(row[0], dtype=self.dtype)
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        if self.dtype is not None:
+            payload = np.asarray(value, dtype=self.dtype).tobytes()
+        else:
+            payload = json.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)",
+                (key, payload, time.time() + self.ttl),
+            )
+            if self.maxsize is not None:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM "
+                    f"{self.table} ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                    (self.maxsize,),
+                )
+
+    def purge(self) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE expires < ?", (time.time(),)
+            )
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            (size,) = self._conn.execute(
+                f"SELECT COUNT(*) FROM {self.table}"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+class TieredCache:
+    def __init__(self, memory: TTLCache, disk: SQLiteCache | None = None) -> None:
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        stats = {"memory": self.memory.stats()}
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+class SemanticCache:
+    """
+    Maps query embeddings to result-cache keys of previously answered queries.
+
+    Lookups are a single matrix-vector product over the stored unit vectors; a
+    neighbour is reused when its cosine similarity reaches `threshold`.
+    """
+
+    def __init__(self, maxsize: int, dim: int, threshold: float) -> None:
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._vectors = np.zeros((maxsize, dim), dtype=np.float32)
+        self._last_used = np.zeros(maxsize, dtype=np.int64)
+        self._keys: list[str | None] = [None] * maxsize
+        self._size = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector: list[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        return v / (np.linalg.norm(v) or 1.0)
+
+    def _neighbours(self, q: np.ndarray) -> np.ndarray:
+        """Slots within `threshold` of the unit vector `q`, nearest first."""
+        sims = self._vectors[: self._size] @ q
+        close = np.flatnonzero(sims >= self.threshold)
+        return close[np.argsort(-sims[close], kind="stable")]
+
+    def get(self, vector: list[float], prefix: str) -> str | None:
+        """Key of the nearest neighbour whose key starts with `prefix`."""
+        q = self._unit(vector)
+        with self._lock:
+            self._clock += 1
+            for i in self._neighbours(q):
+                key = self._keys[i]
+                if key is not None and key.startswith(prefix):
+                    self._last_used[i] = self._clock
+                    self.hits += 1
+                    return key
+            self.misses += 1
+            return None
+
+    def set(self, vector: list[float], key: str) -> None:
+        q = self._unit(vector)
+        with self._lock:
+            self._clock += 1
+            # reuse the slot of a near-identical query, so a stale key
+            # (e.g. from an older index version) cannot outrank this one
+            if len(close := self._neighbours(q)):
+                i = int(close[0])
+            elif self._size < self.maxsize:
+                i = self._size
+                self._size += 1
+            else:
+                i = int(np.argmin(self._last_used))
+            self._vectors[i] = q
+            self._keys[i] = key
+            self._last_used[i] = self._clock
+
+    def discard(self, key: str) -> None:
+        """Forget `key` once its result has gone, counting its lookup as a miss."""
+        with self._lock:
+            for i in range(self._size):
+                if self._keys[i] == key:
+                    self._keys[i] = None
+                    self._vectors[i] = 0.0
+                    self._last_used[i] = 0
+                    self.hits -= 1
+                    self.misses += 1
+                    return
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": self._size}
+
+
+class IndexVersion:
+    """Build ID stamped by the `pinecone_index` asset, re-read whenever the file changes."""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._mtime: int | None = None
+        self._version = "unversioned"
+
+    def get(self) -> str:
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return "unversioned"
+        if mtime != self._mtime:
+            self._version = json.loads(self.path.read_text())["version"]
+            self._mtime = mtime
+        return self._version
+
+
+index_version = IndexVersion(Paths.BM25 / "index_version.json")
+
+
+def create_cache(
+    table: str,
+    maxsize: int,
+    disk_maxsize: int | None = None,
+    dtype: np.dtype | type | None = None,
+) -> TieredCache:
+    disk = None
+    if cfg.cache.disk_path:
+        disk = SQLiteCache(
+            cfg.cache.disk_path,
+            table=table,
+            ttl=cfg.cache.ttl,
+            maxsize=disk_maxsize,
+            dtype=dtype,
+        )
+        disk.purge()
+    return TieredCache(TTLCache(maxsize=maxsize, ttl=cfg.cache.ttl), disk)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Caches query embeddings as float32 arrays; document embeddings are passed
+    straight through.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: TieredCache, namespace: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.namespace = namespace
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        query = normalise_query(text)
+        key = f"{self.namespace}:{query}"
+        embedding = self.cache.get(key)
+        if embedding is None:
+            embedding = np.asarray(self.embeddings.embed_query(query), np.float32)
+            self.cache.set(key, embedding)
+        return embedding.tolist()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        query = normalise_query(text)
+        key = f"{self.namespace}:{query}"
+        embedding = self.cache.get(key)
+        if embedding is None:
+            embedding = await self.embeddings.aembed_query(query)
+            embedding = np.asarray(embedding, np.float32)
+            self.cache.set(key, embedding)
+        return embedding.tolist()
+
+
+class CachedSparseEncoder:
+    """Caches `encode_queries` results of a fitted sparse encoder such as BM25."""
+
+    def __init__(self, encoder, cache: TieredCache, namespace: str):
+        self.encoder = encoder
+        self.cache = cache
+        self.namespace = namespace
+
+    def encode_documents(self, texts):
+        return self.encoder.encode_documents(texts)
+
+    def encode_queries(self, texts):
+        if isinstance(texts, list):
+            return [self.encode_queries(text) for text in texts]
+
+        query = normalise_query(texts)
+        key = f"{self.namespace}:{query}"
+        sparse = self.cache.get(key)
+        if sparse is None:
+            sparse = self.encoder.encode_queries(query)
+            self.cache.set(key, sparse)
+        return {"indices": list(sparse["indices"]), "values": list(sparse["values"])}
+
+
+class DocumentEmbeddingCache(Embeddings):
+    """
+    Content-addressed store of document embeddings for index builds.
+
+    Vectors are float32 blobs in SQLite keyed by `(model, dim, sha256(text))`,
+    so unchanged chunks are never re-embedded across runs. Queries are passed
+    straight through.
+    """
+
+    BATCH = 500
+
+    def __init__(
+        self, embeddings: Embeddings, path: str | Path, model: str, dim: int
+    ) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.embeddings = embeddings
+        self.model = model
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, dim INTEGER, "
+            "hash BLOB, vector BLOB NOT NULL, PRIMARY KEY (model, dim, hash)) "
+            "WITHOUT ROWID"
+        )
+
+    def _lookup(self, hashes: list[bytes]) -> dict[bytes, list[float]]:
+        found = {}
+        for start in range(0, len(hashes), self.BATCH):
+            batch = hashes[start : start + self.BATCH]
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT hash, vector FROM embeddings WHERE model = ? AND dim = ? "
+                    f"AND hash IN ({', '.join('?' * len(batch))})",
+                    (self.model, self.dim, *batch),
+                ).fetchall()
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        hashes = [hashlib.sha256(text.encode()).digest() for text in texts]
+        found = self._lookup(list(set(hashes)))
+        missing = list({h: text for h, text in zip(hashes, texts) if h not in found})
+        n_found = sum(h in found for h in hashes)
+
+        if missing:
+            by_hash = dict(zip(hashes, texts))
+            vectors = self.embeddings.embed_documents([by_hash[h] for h in missing])
+            rows = [
+                (self.model, self.dim, h, np.asarray(v, np.float32).tobytes())
+                for h, v in zip(missing, vectors)
+            ]
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows
+                )
+            found.update(zip(missing, vectors))
+        with self._lock:
+            self.hits += n_found
+            self.misses += len(texts) - n_found
+        return [list(found[h]) for h in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> dict[str, int | float]:
+        total = self.hits + self.misses
+        return {
+            "embedding_cache_hits": self.hits,
+            "embedding_cache_misses": self.misses,
+            "embedding_cache_hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,135 @@
+import functools
+import math
+import re
+from collections import Counter
+
+import tiktoken
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from src.common.settings import cfg
+
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=512,
+    separators=["\n\n", "\n", ". "],
+    keep_separator=False,
+)
+
+Span = tuple[int, int, int]
+
+
+@functools.cache
+def encoding_for(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _encoding() -> tiktoken.Encoding:
+    return encoding_for(cfg.model.llm)
+
+
+def count_tokens(text: str, encoding: tiktoken.Encoding | None = None) -> int:
+    encoding = encoding or _encoding()
+    return len(encoding.encode(text))
+
+
+def _split_with_offsets(text: str):
+    cursor = 0
+    for piece in text_splitter.split_text(text):
+        start = text.find(piece, cursor)
+        if start == -1:
+            start = text.find(piece)
+        yield piece, start
+        cursor = start + 1
+
+
+def chunk_spans(text: str, encoding: tiktoken.Encoding | None = None) -> list[Span]:
+    """`(start, end, n_tokens)` of each explanation snippet within `text`."""
+    encoding = encoding or _encoding()
+    return [
+        (start, start + len(piece), len(encoding.encode(piece)))
+        for piece, start in _split_with_offsets(text)
+    ]
+
+
+def encode_spans(spans: list[Span]) -> str:
+    # Pinecone metadata cannot hold lists of numbers, so spans travel as a string
+    return ";".join(f"{s}:{e}:{n}" for s, e, n in spans)
+
+
+def decode_spans(encoded: str) -> list[Span]:
+    return [tuple(map(int, span.split(":"))) for span in encoded.split(";") if span]
+
+
+def join_spans(
+    contents: list[str], metadatas: list[dict], separator: str = "\n\n"
+) -> str | None:
+    """Spans of chunks joined with `separator`, shifted to the joined text."""
+    if not all("spans" in metadata for metadata in metadatas):
+        return None
+    spans, offset = [], 0
+    for content, metadata in zip(contents, metadatas):
+        spans.extend(
+            (s + offset, e + offset, n) for s, e, n in decode_spans(metadata["spans"])
+        )
+        offset += len(content) + len(separator)
+    return encode_spans(spans)
+
+
+def _terms(text: str) -> list[str]:
+    return re.findall(r"\w+", text.casefold())
+
+
+def select_context(query: str, document: Document, budget: int) -> list[Document]:
+    """
+    Most query-relevant snippets of `document` that fit in `budget` tokens.
+
+    Snippets are ranked by BM25 against the query, using the other snippets of
+    the same document as the corpus, and returned in document order. Documents
+    indexed before spans were stored are split here, with tokens estimated.
+    """
+    text = document.page_content
+    if encoded := document.metadata.get("spans"):
+        spans = decode_spans(encoded)
+    else:
+        spans = [
+            (start, start + len(piece), len(piece) // 4)
+            for piece, start in _split_with_offsets(text)
+        ]
+    if not spans:
+        return []
+
+    snippets = [_terms(text[s:e]) for s, e, _ in spans]
+    avgdl = sum(map(len, snippets)) / len(snippets) or 1.0
+    df = Counter(term for terms in snippets for term in set(terms))
+    query_terms = set(_terms(query))
+
+    def bm25(terms: list[str], k1=1.2, b=0.75) -> float:
+        tf = Counter(terms)
+        score = 0.0
+        for term in query_terms & tf.keys():
+            idf = math.log(1 + (len(snippets) - df[term] + 0.5) / (df[term] + 0.5))
+            score += (
+                idf
+                * tf[term]
+                * (k1 + 1)
+                / (tf[term] + k1 * (1 - b + b * len(terms) / avgdl))
+            )
+        return score
+
+    scores = [bm25(terms) for terms in snippets]
+    chosen, used = [], 0
+    for i in sorted(range(len(spans)), key=lambda i: -scores[i]):
+        n_tokens = spans[i][2]
+        if used + n_tokens <= budget or not chosen:
+            chosen.append(i)
+            used += n_tokens
+
+    return [
+        Document(
+            page_content=text[spans[i][0] : spans[i][1]], metadata=document.metadata
+        )
+        for i in sorted(chosen)
+    ]
@@ -0,0 +1,147 @@
+from typing import Literal
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.model.context import join_spans
+
+Aggregation = Literal["max", "sum", "mean_top_m", "rrf"]
+
+
+class GroupedDocuments:
+    """
+    Ranked dataset groups over a flat list of retrieved chunks.
+
+    Only chunk contents, metadata, indices and scores are held; the joined
+    page content of a group is built when `document(i)` is called, so callers
+    materialise just the groups they return.
+    """
+
+    def __init__(
+        self,
+        contents: list[str],
+        metadatas: list[dict],
+        first: list[int],
+        scores: list[float],
+        members: list[list[int]],
+        rerank_scores: list[float] | None = None,
+    ) -> None:
+        self.contents = contents
+        self.metadatas = metadatas
+        self.first = first
+        self.scores = scores
+        self.members = members
+        self.rerank_scores = rerank_scores
+
+    def __len__(self) -> int:
+        return len(self.first)
+
+    def __getitem__(self, i: int) -> Document:
+        return self.document(i)
+
+    @property
+    def ids(self) -> list[str]:
+        return [self.metadatas[i]["id"] for i in self.first]
+
+    def content(self, i: int) -> str:
+        return "\n\n".join(self.contents[j] for j in self.members[i])
+
+    def document(self, i: int) -> Document:
+        metadata = self.metadatas[self.first[i]] | {"score": self.scores[i]}
+        if self.rerank_scores is not None:
+            metadata["rerank_score"] = self.rerank_scores[i]
+        if "spans" in metadata:
+            members = self.members[i]
+            spans = join_spans(
+                [self.contents[j] for j in members],
+                [self.metadatas[j] for j in members],
+            )
+            if spans is not None:
+                metadata["spans"] = spans
+        return Document(page_content=self.content(i), metadata=metadata)
+
+    def to_documents(self) -> list[Document]:
+        return [self.document(i) for i in range(len(self))]
+
+    def reordered(
+        self, order: list[int], rerank_scores: list[float]
+    ) -> "GroupedDocuments":
+        return GroupedDocuments(
+            self.contents,
+            self.metadatas,
+            first=[self.first[i] for i in order],
+            scores=[self.scores[i] for i in order],
+            members=[self.members[i] for i in order],
+            rerank_scores=[rerank_scores[i] for i in order],
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "contents": self.contents,
+            "metadatas": self.metadatas,
+            "first": self.first,
+            "scores": self.scores,
+            "members": self.members,
+            "rerank_scores": self.rerank_scores,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "GroupedDocuments":
+        return cls(**data)
+
+
+def group_chunks(
+    chunks: list[Document],
+    aggregation: Aggregation = "max",
+    top_m: int = 3,
+    rrf_k: int = 60,
+) -> GroupedDocuments:
+    n = len(chunks)
+    contents = [c.page_content for c in chunks]
+    metadatas = [c.metadata for c in chunks]
+    if n == 0:
+        return GroupedDocuments(contents, metadatas, [], [], [])
+
+    codes: dict[str, int] = {}
+    inverse = np.fromiter(
+        (codes.setdefault(m["id"], len(codes)) for m in metadatas), np.int64, n
+    )
+    scores = np.fromiter((m["score"] for m in metadatas), np.float64, n)
+    n_groups = len(codes)
+    first = np.full(n_groups, n, dtype=np.int64)
+    np.minimum.at(first, inverse, np.arange(n))
+
+    # chunks ordered by group, best score first within each group
+    by_score = np.lexsort((-scores, inverse))
+    counts = np.bincount(inverse, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    if aggregation == "max":
+        agg = scores[by_score[starts]]
+    elif aggregation == "sum":
+        agg = np.bincount(inverse, weights=scores, minlength=n_groups)
+    elif aggregation == "mean_top_m":
+        position = np.arange(n) - np.repeat(starts, counts)
+        keep = by_score[position < top_m]
+        agg = np.bincount(
+            inverse[keep], weights=scores[keep], minlength=n_groups
+        ) / np.minimum(counts, top_m)
+    elif aggregation == "rrf":
+        rank = np.empty(n, dtype=np.int64)
+        rank[np.argsort(-scores, kind="stable")] = np.arange(n)
+        agg = np.bincount(inverse, weights=1.0 / (rrf_k + rank + 1), minlength=n_groups)
+    else:
+        raise ValueError(f"Unknown aggregation: {aggregation}")
+
+    # members keep retrieval order so joined content matches the chunk ranking
+    by_position = np.argsort(inverse, kind="stable")
+    members = np.split(by_position, np.cumsum(counts)[:-1])
+
+    ranking = np.lexsort((first, -agg))
+    return GroupedDocuments(
+        contents,
+        metadatas,
+        first=first[ranking].tolist(),
+        scores=agg[ranking].tolist(),
+        members=[members[g].tolist() for g in ranking],
+    )
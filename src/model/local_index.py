@@ -0,0 +1,233 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+BLOCK_ROWS = 8192
+CURRENT = "current"
+RECORDS_SCHEMA = {"context": pl.String, "metadata": pl.String}
+
+
+class LocalIndexWriter:
+    """
+    Builds a local index from batches of chunks with flat memory use.
+
+    Dense vectors are appended to a raw float32 file and records to Parquet
+    parts as batches arrive. `finish` converts them, block by block, into the
+    layout `LocalHybridIndex` reads, and builds the sparse postings by reading
+    the contexts back once the BM25 encoder is fitted.
+
+    Each build goes into its own `versions/<version>` directory and is then
+    published by swapping the `current` symlink, so files that running
+    readers have memory-mapped are never rewritten.
+    """
+
+    def __init__(
+        self, path: str | Path, version: str, dim: int, quantize: bool = False
+    ) -> None:
+        self.root = Path(path)
+        self.path = self.root / "versions" / version
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.path.mkdir(parents=True)
+        self.dim = dim
+        self.quantize = quantize
+        self.n = 0
+        self._parts: list[Path] = []
+        self._raw = self.path / "dense.f32.tmp"
+        self._dense = open(self._raw, "wb")
+
+    def add(
+        self, vectors: list[list[float]], contexts: list[str], metadatas: list[dict]
+    ) -> None:
+        np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim).tofile(self._dense)
+        part = self.path / f"records-{len(self._parts):05d}.parquet.tmp"
+        pl.DataFrame(
+            {"context": contexts, "metadata": [json.dumps(m) for m in metadatas]},
+            schema=RECORDS_SCHEMA,
+        ).write_parquet(part)
+        self._parts.append(part)
+        self.n += len(contexts)
+
+    def finish(self, sparse_encoder) -> None:
+        self._dense.close()
+        try:
+            self._write_dense()
+            records = self.path / "records.parquet"
+            if self._parts:
+                pl.scan_parquet(self._parts).sink_parquet(records)
+            else:
+                pl.DataFrame(schema=RECORDS_SCHEMA).write_parquet(records)
+            self._write_postings(records, sparse_encoder)
+        except BaseException:
+            shutil.rmtree(self.path, ignore_errors=True)
+            raise
+        finally:
+            self._raw.unlink(missing_ok=True)
+            for part in self._parts:
+                part.unlink(missing_ok=True)
+        self._publish()
+
+    def _publish(self) -> None:
+        link = self.root / CURRENT
+        tmp = self.root / f"{CURRENT}.tmp"
+        tmp.unlink(missing_ok=True)
+        tmp.symlink_to(self.path.relative_to(self.root), target_is_directory=True)
+        os.replace(tmp, link)
+
+        # keep the previous version for workers that have not reopened yet;
+        # older ones can go, since unlinking leaves existing mappings valid
+        versions = sorted(
+            (self.root / "versions").iterdir(), key=lambda p: p.stat().st_mtime
+        )
+        for old in versions[:-2]:
+            if old != self.path:
+                shutil.rmtree(old, ignore_errors=True)
+
+    def _write_dense(self) -> None:
+        shape = (self.n, self.dim)
+        scale_path = self.path / "dense_scale.npy"
+        if self.n == 0:
+            dtype = np.int8 if self.quantize else np.float32
+            np.save(self.path / "dense.npy", np.empty(shape, dtype=dtype))
+            scale_path.unlink(missing_ok=True)
+            return
+
+        raw = np.memmap(self._raw, dtype=np.float32, mode="r", shape=shape)
+        out = np.lib.format.open_memmap(
+            self.path / "dense.npy",
+            mode="w+",
+            dtype=np.int8 if self.quantize else np.float32,
+            shape=shape,
+        )
+        scale = np.empty(self.n, dtype=np.float32)
+        for start in range(0, self.n, BLOCK_ROWS):
+            block = np.asarray(raw[start : start + BLOCK_ROWS])
+            if self.quantize:
+                block_scale = np.abs(block).max(axis=1) / 127.0
+                block_scale[block_scale == 0] = 1.0
+                out[start : start + len(block)] = np.round(
+                    block / block_scale[:, None]
+                ).astype(np.int8)
+                scale[start : start + len(block)] = block_scale
+            else:
+                out[start : start + len(block)] = block
+        out.flush()
+        del out, raw
+        if self.quantize:
+            np.save(scale_path, scale)
+        else:
+            scale_path.unlink(missing_ok=True)
+
+    def _write_postings(self, records: Path, sparse_encoder) -> None:
+        # sparse vectors are stored term-major (CSR of the transposed matrix),
+        # so a query only touches the posting lists of its own terms
+        docs, terms, values = [], [], []
+        contexts = pl.read_parquet(records, columns=["context"])
+        for start in range(0, len(contexts), BLOCK_ROWS):
+            block = contexts["context"].slice(start, BLOCK_ROWS).to_list()
+            sparse = sparse_encoder.encode_documents(block)
+            lengths = [len(s["indices"]) for s in sparse]
+            docs.append(
+                np.repeat(
+                    np.arange(start, start + len(sparse), dtype=np.int32), lengths
+                )
+            )
+            terms.append(
+                np.fromiter(
+                    (i for s in sparse for i in s["indices"]), np.uint32, sum(lengths)
+                )
+            )
+            values.append(
+                np.fromiter(
+                    (v for s in sparse for v in s["values"]), np.float32, sum(lengths)
+                )
+            )
+        del contexts
+        docs = np.concatenate(docs) if docs else np.empty(0, np.int32)
+        terms = np.concatenate(terms) if terms else np.empty(0, np.uint32)
+        values = np.concatenate(values) if values else np.empty(0, np.float32)
+
+        vocab, columns = np.unique(terms, return_inverse=True)
+        order = np.lexsort((docs, columns))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(columns))))
+        np.save(self.path / "vocab.npy", vocab)
+        np.save(self.path / "postings_indptr.npy", indptr.astype(np.int64))
+        np.save(self.path / "postings_docs.npy", docs[order])
+        np.save(self.path / "postings_values.npy", values[order])
+
+
+class LocalHybridIndex:
+    """
+    In-process stand-in for a Pinecone dotproduct index.
+
+    Dense vectors are memory-mapped (float32, or int8 with per-row scales) and
+    sparse BM25 vectors are held as an inverted index. `query` mirrors the
+    Pinecone `Index.query` call used by `HybridSearchRetriever`; the caller
+    passes vectors already scaled by alpha, so scores match a hybrid index.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        path = Path(path)
+        if (path / CURRENT).exists():
+            # pin the version, so a later swap of `current` cannot mix files
+            path = (path / CURRENT).resolve()
+        self.dense = np.load(path / "dense.npy", mmap_mode="r")
+        scale_path = path / "dense_scale.npy"
+        self.scale = np.load(scale_path) if scale_path.exists() else None
+        self.vocab = np.load(path / "vocab.npy")
+        self.indptr = np.load(path / "postings_indptr.npy")
+        self.docs = np.load(path / "postings_docs.npy", mmap_mode="r")
+        self.values = np.load(path / "postings_values.npy", mmap_mode="r")
+        self.records = pl.read_parquet(path / "records.parquet")
+
+    def __len__(self) -> int:
+        return self.dense.shape[0]
+
+    def _dense_scores(self, vector: list[float]) -> np.ndarray:
+        q = np.asarray(vector, dtype=np.float32)
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), BLOCK_ROWS):
+            block = self.dense[start : start + BLOCK_ROWS]
+            scores[start : start + len(block)] = block.astype(np.float32) @ q
+        if self.scale is not None:
+            scores *= self.scale
+        return scores
+
+    def _add_sparse_scores(self, scores: np.ndarray, sparse_vector: dict) -> None:
+        terms = np.asarray(sparse_vector["indices"], dtype=np.uint32)
+        weights = np.asarray(sparse_vector["values"], dtype=np.float32)
+        columns = np.searchsorted(self.vocab, terms)
+        for column, term, weight in zip(columns, terms, weights):
+            if column < len(self.vocab) and self.vocab[column] == term:
+                start, end = self.indptr[column], self.indptr[column + 1]
+                scores[self.docs[start:end]] += weight * self.values[start:end]
+
+    def query(
+        self,
+        vector: list[float],
+        sparse_vector: dict | None = None,
+        top_k: int = 10,
+        include_metadata: bool = True,
+        **kwargs,
+    ) -> dict:
+        scores = self._dense_scores(vector)
+        if sparse_vector is not None:
+            self._add_sparse_scores(scores, sparse_vector)
+
+        k = min(top_k, len(scores))
+        if k == 0:
+            return {"matches": []}
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        matches = [{"id": str(i), "score": float(scores[i])} for i in top]
+        if include_metadata:
+            rows = self.records[top.tolist()].to_dicts()
+            for match, row in zip(matches, rows):
+                match["metadata"] = json.loads(row["metadata"]) | {
+                    "context": row["context"]
+                }
+        return {"matches": matches}
@@ -0,0 +1,89 @@
+import functools
+from collections.abc import Callable
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+NODE_SECONDS = Histogram(
+    "catalogue_node_seconds",
+    "Wall time of each LangGraph node",
+    ["node"],
+    buckets=BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "catalogue_stage_seconds",
+    "Wall time of retrieval stages (embed, index_query, grouping, rerank, serialise)",
+    ["stage"],
+    buckets=BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "catalogue_llm_tokens",
+    "Tokens reported by chat model calls",
+    ["model", "kind"],
+)
+
+
+def timed_node(name: str, node: Callable) -> Callable:
+    @functools.wraps(node)
+    async def wrapper(state):
+        with NODE_SECONDS.labels(name).time():
+            return await node(state)
+
+    return wrapper
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """
+    Adds the `usage_metadata` of every finished chat model call to `LLM_TOKENS`.
+
+    Streamed calls have no `token_usage` in `llm_output`, so usage is read from
+    the generated messages; streaming models need `stream_usage=True` for it.
+    """
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        default = (response.llm_output or {}).get("model_name", "unknown")
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if not usage:
+                    continue
+                model = message.response_metadata.get("model_name", default)
+                for key, kind in (("input", "prompt"), ("output", "completion")):
+                    if count := usage.get(f"{key}_tokens"):
+                        LLM_TOKENS.labels(model, kind).inc(count)
+
+
+token_usage = TokenUsageHandler()
+
+
+class CacheCollector(Collector):
+    """
+    Reports cache counters at scrape time from the `stats()` the caches keep.
+
+    `stats` returns `{cache: {tier: {"hits", "misses", "size"}}}`; single-tier
+    caches may return the inner dict directly and are labelled `memory`.
+    """
+
+    def __init__(self, stats: Callable[[], dict]) -> None:
+        self.stats = stats
+
+    def collect(self):
+        labels = ["cache", "tier"]
+        hits = CounterMetricFamily("catalogue_cache_hits", "Cache hits", labels=labels)
+        misses = CounterMetricFamily(
+            "catalogue_cache_misses", "Cache misses", labels=labels
+        )
+        size = GaugeMetricFamily("catalogue_cache_size", "Cache entries", labels=labels)
+        for cache, tiers in self.stats().items():
+            if "hits" in tiers:
+                tiers = {"memory": tiers}
+            for tier, stats in tiers.items():
+                hits.add_metric([cache, tier], stats["hits"])
+                misses.add_metric([cache, tier], stats["misses"])
+                size.add_metric([cache, tier], stats["size"])
+        yield from (hits, misses, size)
@@ -1,20 +1,34 @@
+import asyncio
 import logging
 from typing import TypedDict
 
+import numpy as np
 from dotenv import load_dotenv
-from langchain_community.retrievers import PineconeHybridSearchRetriever
-from langchain_core.documents import Document
 from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langgraph.graph import END, START, StateGraph
 from pinecone import Pinecone
 from pinecone_text.sparse import BM25Encoder
 
 from src.common.settings import cfg
+from src.common.utils import Paths
+from src.model.bm25 import BinaryBM25Encoder
+from src.model.cache import (
+    CachedEmbeddings,
+    CachedSparseEncoder,
+    create_cache,
+    index_version,
+    normalise_query,
+)
 from src.model.citations import answer_citations, format_docs_with_id
+from src.model.context import select_context
+from src.model.grouping import GroupedDocuments, group_chunks
 from src.model.hallucination import hallucination_grader
+from src.model.local_index import LocalHybridIndex
+from src.model.metrics import STAGE_SECONDS, timed_node, token_usage
 from src.model.moderation import moderate
 from src.model.rag import rag_chain
+from src.model.rerank import rerank
+from src.model.retriever import HybridSearchRetriever
 
 _ = load_dotenv()
 
@@ -26,7 +40,8 @@ logging.basicConfig(
 
 class SearchState(TypedDict):
     query: str
-    documents: list[str]
+    documents: GroupedDocuments
+    key: str | None
 
 
 class GenerationState(TypedDict):
@@ -39,119 +54,219 @@ class GenerationState(TypedDict):
     inappropriate: str
 
 
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=512,
-    separators=["\n\n", "\n", ". "],
-    keep_separator=False,
-)
+def _group_by_document(documents):
+    return group_chunks(
+        documents,
+        aggregation=cfg.model.aggregation,
+        top_m=cfg.model.top_m,
+        rrf_k=cfg.model.rrf_k,
+    )
 
 
-def _group_by_document(documents):
-    grouped_id: dict[str, list[Document]] = {}
-
-    for d in documents:
-        id = d.metadata["id"]
-        if id not in grouped_id:
-            grouped_id[id] = []
-        grouped_id[id].append(d)
-
-    out_nodes = []
-    for doc in grouped_id.values():
-        content = "\n\n".join([d.page_content for d in doc])
-        scores = [d.metadata["score"] for d in doc]
-        document = Document(
-            page_content=content, metadata=doc[0].metadata | {"score": max(scores)}
-        )
-        out_nodes.append(document)
-    return out_nodes
+def _load_bm25_encoder() -> BM25Encoder:
+    if (Paths.BM25 / "bm25.bin").exists():
+        return BinaryBM25Encoder().load(Paths.BM25 / "bm25.bin")
+    return BM25Encoder().load(str(Paths.BM25 / "bm25_values.json"))
+
 
+def _bm25_namespace(bm25_encoder: BM25Encoder) -> str:
+    return f"bm25:{bm25_encoder.n_docs}:{bm25_encoder.avgdl}"
 
-def create_retriever():
-    bm25_encoder = BM25Encoder().load("bm25/bm25_values.json")
-    pc = Pinecone()
-    index = pc.Index(cfg.datastore.index_name, host=cfg.datastore.host)
-    embeddings = OpenAIEmbeddings(model=cfg.datastore.embed_model)
-    return PineconeHybridSearchRetriever(
+
+def create_retriever(http_client=None, http_async_client=None):
+    # read first, so a build finishing while we load is picked up on refresh
+    version = index_version.get()
+    bm25_encoder = _load_bm25_encoder()
+    sparse_encoder = CachedSparseEncoder(
+        bm25_encoder,
+        cache=create_cache(
+            "query_sparse",
+            cfg.cache.embeddings_maxsize,
+            cfg.cache.embeddings_disk_maxsize,
+        ),
+        namespace=_bm25_namespace(bm25_encoder),
+    )
+    if cfg.datastore.backend == "local":
+        index = LocalHybridIndex(cfg.datastore.local_path)
+    else:
+        pc = Pinecone(pool_threads=cfg.api.pool_threads)
+        index = pc.Index(
+            cfg.datastore.index_name,
+            host=cfg.datastore.host,
+            pool_threads=cfg.api.pool_threads,
+        )
+    embeddings = CachedEmbeddings(
+        OpenAIEmbeddings(
+            model=cfg.datastore.embed_model,
+            http_client=http_client,
+            http_async_client=http_async_client,
+        ),
+        cache=create_cache(
+            "query_vectors",
+            cfg.cache.embeddings_maxsize,
+            cfg.cache.embeddings_disk_maxsize,
+            dtype=np.float32,
+        ),
+        namespace=cfg.datastore.embed_model,
+    )
+    return HybridSearchRetriever(
         embeddings=embeddings,
-        sparse_encoder=bm25_encoder,
+        sparse_encoder=sparse_encoder,
         index=index,
         top_k=cfg.model.top_k,
         alpha=cfg.model.alpha,
+        adaptive=cfg.model.adaptive,
+        adaptive_start_k=cfg.model.adaptive_start_k,
+        adaptive_score_ratio=cfg.model.adaptive_score_ratio,
+        adaptive_min_new_ids=cfg.model.adaptive_min_new_ids,
+        index_version=version,
     )
 
 
-def retrieve(state, retriever):
-    logging.info("Starting retrieval process...")
-    query = state["query"]
+async def refresh_retriever(retriever) -> None:
+    """Reload BM25 statistics, and a local index, when the index version changes."""
+    version = index_version.get()
+    if version == retriever.index_version:
+        return
+    bm25_encoder = await asyncio.to_thread(_load_bm25_encoder)
+    if cfg.datastore.backend == "local":
+        retriever.index = await asyncio.to_thread(
+            LocalHybridIndex, cfg.datastore.local_path
+        )
+    # the re-ranker shares this encoder wrapper, so it picks up the swap too
+    retriever.sparse_encoder.encoder = bm25_encoder
+    retriever.sparse_encoder.namespace = _bm25_namespace(bm25_encoder)
+    retriever.index_version = version
+    logging.info(f"Reloaded index version {version}")
 
-    documents = retriever.invoke(query)
-    documents = _group_by_document(documents)
-    return {"documents": documents, "query": query}
 
+async def retrieve(
+    state, retriever, result_cache=None, semantic_cache=None, reranker=None
+):
+    logging.info("Starting retrieval process...")
+    query = state["query"]
+    await refresh_retriever(retriever)
 
-def explain_dataset(state):
+    if reranker is None:
+        top_k, mode = retriever.top_k, ""
+    else:
+        top_k, mode = cfg.model.first_stage_k, f"{reranker.name}:"
+    if retriever.adaptive:
+        mode += "adaptive:"
+    prefix = f"{index_version.get()}:{top_k}:{retriever.alpha}:{mode}"
+    key = prefix + normalise_query(query)
+    # a disk-tier lookup hits SQLite and decodes JSON, so keep it off the loop
+    if (
+        result_cache is not None
+        and (cached := await asyncio.to_thread(result_cache.get, key)) is not None
+    ):
+        logging.info("Retrieval served from result cache")
+        documents = GroupedDocuments.from_dict(cached)
+        return {"documents": documents, "query": query, "key": key}
+
+    if semantic_cache is not None and result_cache is not None:
+        embedding = await retriever.embeddings.aembed_query(query)
+        if (neighbour := semantic_cache.get(embedding, prefix)) is not None:
+            cached = await asyncio.to_thread(result_cache.get, neighbour)
+            if cached is not None:
+                logging.info(f"Retrieval served from semantic cache ({neighbour})")
+                documents = GroupedDocuments.from_dict(cached)
+                return {"documents": documents, "query": query, "key": neighbour}
+            semantic_cache.discard(neighbour)
+
+    documents = await retriever.ainvoke(query, top_k=top_k)
+    with STAGE_SECONDS.labels("grouping").time():
+        documents = _group_by_document(documents)
+    cacheable = True
+    if reranker is not None:
+        with STAGE_SECONDS.labels("rerank").time():
+            documents, cacheable = await asyncio.to_thread(
+                rerank,
+                reranker,
+                query,
+                documents,
+                budget=cfg.model.rerank_budget_ms / 1000,
+            )
+    # a fallback to first-stage order must not be served as re-ranked later
+    if result_cache is None or not cacheable:
+        return {"documents": documents, "query": query, "key": None}
+    with STAGE_SECONDS.labels("serialise").time():
+        await asyncio.to_thread(result_cache.set, key, documents.to_dict())
+    if semantic_cache is not None:
+        semantic_cache.set(embedding, key)
+    return {"documents": documents, "query": query, "key": key}
+
+
+async def explain_dataset(state):
     logging.info("Starting explain generation...")
     query = state["query"]
     document = state["document"]
 
-    chunks = text_splitter.split_documents([document])
+    chunks = select_context(query, document, cfg.model.explain_token_budget)
     docs = format_docs_with_id(chunks)
 
-    generation = rag_chain.invoke({"query": query, "context": docs})
+    generation = await rag_chain.ainvoke({"query": query, "context": docs})
 
     return {
         "query": query,
         "document": document,
-        # "chunks": [c.dict() for c in chunks],
+        "chunks": [c.dict() for c in chunks],
     } | {"generation": generation}
 
 
-def moderate_generation(state):
+async def moderate_generation(state):
     logging.info("Starting moderation...")
     generation = state["generation"]
 
-    moderation = moderate.invoke(generation)
+    moderation = await moderate.ainvoke(generation)
     if moderation["output"] != generation:
         logging.warning("Inappropriate content found in generation")
-        state["generation"] = "Inappropriate content found in generation."
-        state["inappropriate"] = generation
-    else:
-        logging.info("Generation content is appropriate")
+        return {"inappropriate": generation}
 
-    return state
+    logging.info("Generation content is appropriate")
+    return {}
 
 
-def check_hallucination(state):
+async def check_hallucination(state):
     logging.info("Starting hallucination check process...")
-    query = state["query"]
-    document = state["document"]
+    # grade against the snippets the generation was given, not the whole document
+    facts = "\n\n".join(chunk["page_content"] for chunk in state["chunks"])
     generation = state["generation"]
 
-    score = hallucination_grader.invoke(
-        {"document": document, "generation": generation}
+    score = await hallucination_grader.ainvoke(
+        {"document": facts, "generation": generation}
     )
     if score.binary_score == "yes":
         logging.info("No hallucination found in generation")
-        state["generation"] = generation
     else:
         logging.warning("Hallucination found in generation")
-        state["generation"] = "Hallucination found in generation."
+    return {"hallucination": score.binary_score}
 
-    return state
+
+def apply_checks(state):
+    if "inappropriate" in state:
+        return {"generation": "Inappropriate content found in generation."}
+    if state.get("hallucination", "yes") != "yes":
+        return {"generation": "Hallucination found in generation."}
+    return {}
 
 
 def skip_hallucination(state):
-    if state["generation"] == "Inappropriate content found in generation.":
-        return END
+    if "inappropriate" in state:
+        return "apply_checks"
     else:
         return "check_hallucination"
 
 
-def search_graph():
-    retriever = create_retriever()
+def search_graph(retriever=None, result_cache=None, semantic_cache=None, reranker=None):
+    if retriever is None:
+        retriever = create_retriever()
+
+    async def _retrieve(state):
+        return await retrieve(state, retriever, result_cache, semantic_cache, reranker)
 
     workflow = StateGraph(SearchState)
-    workflow.add_node("retrieve", lambda state: retrieve(state, retriever))
+    workflow.add_node("retrieve", timed_node("retrieve", _retrieve))
     # workflow.add_node("compress", lambda state: compress(state, retriever))
 
     workflow.add_edge(START, "retrieve")
@@ -161,38 +276,111 @@ def search_graph():
     return workflow.compile()
 
 
-def generation_graph():
+def generation_graph(concurrent_checks=None):
+    if concurrent_checks is None:
+        concurrent_checks = cfg.model.concurrent_checks
+
     workflow = StateGraph(GenerationState)
-    workflow.add_node("explain_dataset", explain_dataset)
-    workflow.add_node("moderate_generation", moderate_generation)
-    workflow.add_node("check_hallucination", check_hallucination)
+    for node in (explain_dataset, moderate_generation, check_hallucination):
+        workflow.add_node(node.__name__, timed_node(node.__name__, node))
+    workflow.add_node("apply_checks", apply_checks)
 
     workflow.add_edge(START, "explain_dataset")
-    workflow.add_edge("explain_dataset", "moderate_generation")
-    workflow.add_conditional_edges("moderate_generation", skip_hallucination)
-    workflow.add_edge("check_hallucination", END)
+    if concurrent_checks:
+        workflow.add_edge("explain_dataset", "moderate_generation")
+        workflow.add_edge("explain_dataset", "check_hallucination")
+        workflow.add_edge(
+            ["moderate_generation", "check_hallucination"], "apply_checks"
+        )
+    else:
+        workflow.add_edge("explain_dataset", "moderate_generation")
+        workflow.add_conditional_edges("moderate_generation", skip_hallucination)
+        workflow.add_edge("check_hallucination", "apply_checks")
+    workflow.add_edge("apply_checks", END)
     return workflow.compile()
 
 
-def search(query, thread_id):
-    search = search_graph()
-    output = search.invoke(
+async def asearch(query, thread_id, graph=None):
+    search = graph or search_graph()
+    output = await search.ainvoke(
         {"query": query}, config={"configurable": {"thread_id": thread_id}}
     )
     logging.info("Search done")
     return output
 
 
-def generate(query, document, thread_id):
-    gen = generation_graph()
-    output = gen.invoke(
+def explanation_key(query, document):
+    return (
+        f"{index_version.get()}:{cfg.model.llm}:{document.metadata['id']}:"
+        f"{normalise_query(query)}"
+    )
+
+
+def _passed_checks(output):
+    return "inappropriate" not in output and output.get("hallucination") == "yes"
+
+
+async def agenerate(query, document, thread_id, graph=None, cache=None):
+    key = explanation_key(query, document)
+    if cache is not None and (cached := cache.get(key)) is not None:
+        logging.info("Generation served from explanation cache")
+        return {"query": query, "document": document, "hallucination": "yes"} | cached
+
+    gen = graph or generation_graph()
+    output = await gen.ainvoke(
         {"query": query, "document": document},
-        config={"configurable": {"thread_id": thread_id}},
+        config={"configurable": {"thread_id": thread_id}, "callbacks": [token_usage]},
     )
+    if cache is not None and _passed_checks(output):
+        cache.set(key, {"generation": output["generation"]})
     logging.info("Generation done")
     return output
 
 
+async def astream_generate(query, document, thread_id, graph=None, cache=None):
+    key = explanation_key(query, document)
+    if cache is not None and (cached := cache.get(key)) is not None:
+        logging.info("Generation served from explanation cache")
+        yield "token", {"token": cached["generation"]}
+        yield "moderation", {"appropriate": True}
+        yield "hallucination", {"grounded": True}
+        yield "done", cached
+        return
+
+    gen = graph or generation_graph()
+    async for event in gen.astream_events(
+        {"query": query, "document": document},
+        config={"configurable": {"thread_id": thread_id}, "callbacks": [token_usage]},
+        version="v2",
+    ):
+        node = event.get("metadata", {}).get("langgraph_node")
+        kind, name = event["event"], event["name"]
+
+        if kind == "on_chat_model_stream" and node == "explain_dataset":
+            if token := event["data"]["chunk"].content:
+                yield "token", {"token": token}
+        elif kind == "on_chain_end" and name == node == "moderate_generation":
+            output = event["data"]["output"]
+            yield "moderation", {"appropriate": "inappropriate" not in output}
+        elif kind == "on_chain_end" and name == node == "check_hallucination":
+            output = event["data"]["output"]
+            yield "hallucination", {"grounded": output["hallucination"] == "yes"}
+        elif kind == "on_chain_end" and node is None:
+            output = event["data"]["output"]
+            if cache is not None and _passed_checks(output):
+                cache.set(key, {"generation": output["generation"]})
+            logging.info("Generation done")
+            yield "done", {"generation": output["generation"]}
+
+
+def search(query, thread_id, graph=None):
+    return asyncio.run(asearch(query, thread_id, graph))
+
+
+def generate(query, document, thread_id, graph=None):
+    return asyncio.run(agenerate(query, document, thread_id, graph))
+
+
 if __name__ == "__main__":
     query = "farming in estonia"
     out = search(query=query, thread_id="1234")
@@ -20,5 +20,6 @@ Dataset description:
 """
 
 gen_prompt = ChatPromptTemplate.from_messages([("human", human)])
-llm = ChatOpenAI(model=cfg.model.llm, temperature=0)
+# streamed responses only report token usage when asked to
+llm = ChatOpenAI(model=cfg.model.llm, temperature=0, stream_usage=True)
 rag_chain = gen_prompt | llm | StrOutputParser()
@@ -0,0 +1,60 @@
+import logging
+import time
+from collections.abc import Iterable
+
+from src.model.grouping import GroupedDocuments
+
+
+class BM25Reranker:
+    """Re-scores grouped documents by BM25 over their full joined text."""
+
+    name = "bm25"
+
+    def __init__(self, sparse_encoder) -> None:
+        self.sparse_encoder = sparse_encoder
+
+    def scores(
+        self, query: str, texts: Iterable[str], deadline: float
+    ) -> list[float] | None:
+        query_vec = self.sparse_encoder.encode_queries(query)
+        scores = []
+        for text in texts:
+            if time.perf_counter() > deadline:
+                return None
+            doc_vec = self.sparse_encoder.encode_documents(text)
+            weights = dict(zip(doc_vec["indices"], doc_vec["values"]))
+            scores.append(
+                sum(
+                    value * weights.get(index, 0.0)
+                    for index, value in zip(query_vec["indices"], query_vec["values"])
+                )
+            )
+        return scores
+
+
+RERANKERS = {"bm25": BM25Reranker}
+
+
+def create_reranker(name: str, retriever):
+    return RERANKERS[name](retriever.sparse_encoder)
+
+
+def rerank(
+    reranker, query: str, documents: GroupedDocuments, budget: float
+) -> tuple[GroupedDocuments, bool]:
+    """Groups in re-ranked order, and whether re-ranking finished in `budget`."""
+    start = time.perf_counter()
+    # joined texts are built one at a time, so a timeout stops building them too
+    texts = (documents.content(i) for i in range(len(documents)))
+    scores = reranker.scores(query, texts, deadline=start + budget)
+    elapsed = time.perf_counter() - start
+    if scores is None:
+        logging.warning(
+            f"Re-ranking exceeded {budget * 1000:.0f}ms budget, "
+            "keeping first-stage order"
+        )
+        return documents, False
+
+    logging.info(f"Re-ranked {len(documents)} documents in {elapsed * 1000:.1f}ms")
+    order = sorted(range(len(documents)), key=lambda i: -scores[i])
+    return documents.reordered(order, scores), True
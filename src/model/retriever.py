@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Any
+
+from langchain_community.retrievers import PineconeHybridSearchRetriever
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from pinecone_text.hybrid import hybrid_convex_scale
+
+from src.model.metrics import STAGE_SECONDS
+
+
+def _to_documents(result) -> list[Document]:
+    documents = []
+    for res in result["matches"]:
+        context = res["metadata"].pop("context")
+        metadata = res["metadata"]
+        if "score" not in metadata and "score" in res:
+            metadata["score"] = res["score"]
+        documents.append(Document(page_content=context, metadata=metadata))
+    return documents
+
+
+class HybridSearchRetriever(PineconeHybridSearchRetriever):
+    """
+    Pinecone hybrid retriever with a non-blocking async path.
+
+    Dense embeddings use the async OpenAI client; the Pinecone REST client has
+    no asyncio support, so the query runs on a worker thread using the pooled
+    index connection. With `adaptive` set, `top_k` becomes an upper bound and
+    k grows from `adaptive_start_k` until the score curve drops below
+    `adaptive_score_ratio` of the best hit or few new datasets appear.
+    """
+
+    adaptive: bool = False
+    adaptive_start_k: int = 50
+    adaptive_score_ratio: float = 0.5
+    adaptive_min_new_ids: float = 0.1
+    index_version: str | None = None
+
+    async def _aencode(self, query: str) -> tuple[list[float], dict]:
+        sparse_vec = self.sparse_encoder.encode_queries(query)
+        with STAGE_SECONDS.labels("embed").time():
+            dense_vec = await self.embeddings.aembed_query(query)
+        dense_vec, sparse_vec = hybrid_convex_scale(dense_vec, sparse_vec, self.alpha)
+        sparse_vec["values"] = [float(s) for s in sparse_vec["values"]]
+        return dense_vec, sparse_vec
+
+    async def _aquery(self, dense_vec, sparse_vec, top_k: int, **kwargs):
+        with STAGE_SECONDS.labels("index_query").time():
+            return await asyncio.to_thread(
+                self.index.query,
+                vector=dense_vec,
+                sparse_vector=sparse_vec,
+                top_k=top_k,
+                include_metadata=True,
+                namespace=self.namespace,
+                **kwargs,
+            )
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        **kwargs: Any,
+    ) -> list[Document]:
+        top_k = kwargs.pop("top_k", self.top_k)
+        dense_vec, sparse_vec = await self._aencode(query)
+        if not self.adaptive:
+            result = await self._aquery(dense_vec, sparse_vec, top_k, **kwargs)
+            return _to_documents(result)
+
+        # Pinecone has no offsets, so each page re-queries with double the k;
+        # narrow queries stop after the first one or two small reads
+        k = min(self.adaptive_start_k, top_k)
+        n_ids = 0
+        while True:
+            result = await self._aquery(dense_vec, sparse_vec, k, **kwargs)
+            matches = list(result["matches"])
+            reason, n_ids = self._stop_reason(matches, k, top_k, n_ids)
+            if reason is not None:
+                break
+            k = min(2 * k, top_k)
+
+        if reason == "score_ratio":
+            cutoff = self.adaptive_score_ratio * matches[0]["score"]
+            matches = [m for m in matches if m["score"] >= cutoff]
+            n_ids = len({m["metadata"]["id"] for m in matches})
+        logging.info(
+            f"Adaptive retrieval stopped at k={k} ({reason}): "
+            f"{len(matches)} chunks, {n_ids} datasets"
+        )
+        return _to_documents({"matches": matches})
+
+    def _stop_reason(
+        self, matches: list, k: int, max_k: int, previous_ids: int
+    ) -> tuple[str | None, int]:
+        n_ids = len({m["metadata"]["id"] for m in matches})
+        if len(matches) < k:
+            return "exhausted", n_ids
+        top, last = matches[0]["score"], matches[-1]["score"]
+        if top > 0 and last < self.adaptive_score_ratio * top:
+            return "score_ratio", n_ids
+        if (
+            previous_ids
+            and n_ids - previous_ids < self.adaptive_min_new_ids * previous_ids
+        ):
+            return "saturated", n_ids
+        if k >= max_k:
+            return "max_k", n_ids
+        return None, n_ids
@@ -1,13 +1,94 @@
-from typing import Union
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Literal, get_args
 from uuid import UUID, uuid4
 
-from fastapi import FastAPI
+import httpx
+from fastapi import FastAPI, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from langchain_core.documents import Document
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+from src.common.settings import cfg
+from src.model.cache import (
+    SemanticCache,
+    create_cache,
+    index_version,
+    normalise_query,
+)
+from src.model.grouping import GroupedDocuments
+from src.model.metrics import STAGE_SECONDS, CacheCollector
+from src.model.model import (
+    agenerate,
+    asearch,
+    astream_generate,
+    create_retriever,
+    explanation_key,
+    generation_graph,
+    search_graph,
+)
+from src.model.rerank import create_reranker
+from src.search_api.sessions import create_session_store
+from src.search_api.singleflight import SingleFlight
+
+Field = Literal[
+    "title", "id", "url", "score", "source", "date_created", "snippet", "page_content"
+]
+METADATA_FIELDS = set(get_args(Field)) - {"snippet", "page_content"}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+
+    limits = httpx.Limits(max_connections=cfg.api.max_connections)
+    http_client = httpx.Client(limits=limits)
+    http_async_client = httpx.AsyncClient(limits=limits)
+
+    retriever = create_retriever(
+        http_client=http_client, http_async_client=http_async_client
+    )
+    app.state.retriever = retriever
+    app.state.result_cache = create_cache(
+        "grouped_results", cfg.cache.results_maxsize, cfg.cache.results_disk_maxsize
+    )
+    app.state.semantic_cache = None
+    if cfg.cache.semantic:
+        app.state.semantic_cache = SemanticCache(
+            maxsize=cfg.cache.semantic_maxsize,
+            dim=cfg.datastore.embed_dim,
+            threshold=cfg.cache.semantic_threshold,
+        )
+    reranker = None
+    if cfg.model.two_stage:
+        reranker = create_reranker(cfg.model.reranker, retriever)
+    app.state.search_graph = search_graph(
+        retriever, app.state.result_cache, app.state.semantic_cache, reranker
+    )
+    app.state.generation_graph = generation_graph()
+    app.state.sessions = create_session_store()
+    app.state.explanation_cache = create_cache(
+        "explanations",
+        cfg.cache.explanations_maxsize,
+        cfg.cache.explanations_disk_maxsize,
+    )
+    app.state.search_flight = SingleFlight()
+    app.state.explain_flight = SingleFlight()
+    cache_collector = CacheCollector(lambda: _cache_stats(app))
+    REGISTRY.register(cache_collector)
+    app.state.ready = True
+
+    yield
+
+    app.state.ready = False
+    REGISTRY.unregister(cache_collector)
+    http_client.close()
+    await http_async_client.aclose()
 
-from src.model.model import generate, search
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -16,8 +97,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-document_store = {}
-query_mapping = {}
+
+async def _search(request: Request, q: str, thread_id: UUID) -> dict:
+    return await request.app.state.search_flight.do(
+        normalise_query(q),
+        lambda: asearch(
+            query=q, thread_id=thread_id, graph=request.app.state.search_graph
+        ),
+    )
+
+
+async def _generate(
+    request: Request, query: str, document: Document, thread_id: UUID
+) -> dict:
+    return await request.app.state.explain_flight.do(
+        explanation_key(query, document),
+        lambda: agenerate(
+            query=query,
+            document=document,
+            thread_id=thread_id,
+            graph=request.app.state.generation_graph,
+            cache=request.app.state.explanation_cache,
+        ),
+    )
+
+
+async def _session_documents(request: Request, thread_id: UUID, docids: list[int]):
+    session = request.app.state.sessions.get(thread_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired thread_id")
+    if session["index_version"] != index_version.get():
+        raise HTTPException(
+            status_code=410, detail="The index has been rebuilt since this search"
+        )
+    if not all(0 <= docid < len(session["ids"]) for docid in docids):
+        raise HTTPException(status_code=404, detail="docid out of range")
+
+    # the cached result under the session's key is the one the session ranked
+    if (key := session.get("key")) is not None:
+        cached = await asyncio.to_thread(request.app.state.result_cache.get, key)
+        if cached is not None:
+            grouped = GroupedDocuments.from_dict(cached)
+            return session["query"], [grouped.document(d) for d in docids]
+
+    out = await _search(request, session["query"], thread_id)
+    grouped = out["documents"]
+    positions = {id: i for i, id in enumerate(grouped.ids)}
+    try:
+        documents = [grouped.document(positions[session["ids"][d]]) for d in docids]
+    except KeyError:
+        raise HTTPException(status_code=410, detail="Dataset no longer in the index")
+    return session["query"], documents
 
 
 @app.get("/")
@@ -25,26 +155,193 @@ def index() -> dict[str, str]:
     return {"message": "Make a post request to /query."}
 
 
+@app.get("/ready")
+def ready(request: Request, response: Response) -> dict[str, bool]:
+    is_ready = getattr(request.app.state, "ready", False)
+    if not is_ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": is_ready}
+
+
+def _cache_stats(app: FastAPI) -> dict[str, dict]:
+    retriever = app.state.retriever
+    stats = {
+        "query_embeddings": retriever.embeddings.cache.stats(),
+        "query_sparse": retriever.sparse_encoder.cache.stats(),
+        "search_results": app.state.result_cache.stats(),
+        "sessions": app.state.sessions.stats(),
+        "explanations": app.state.explanation_cache.stats(),
+        "search_flight": app.state.search_flight.stats(),
+        "explain_flight": app.state.explain_flight.stats(),
+    }
+    if app.state.semantic_cache is not None:
+        stats["semantic"] = app.state.semantic_cache.stats()
+    return stats
+
+
+@app.get("/stats")
+def stats(request: Request) -> dict[str, dict]:
+    return _cache_stats(request.app)
+
+
+@app.get("/metrics")
+def metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post("/query")
-async def query(q: str) -> dict[str, Union[UUID, str, list[dict]]]:
+async def query(
+    request: Request,
+    q: str,
+    offset: int = Query(0, ge=0),
+    limit: int | None = Query(None, gt=0),
+    fields: list[Field] | None = Query(None),
+) -> dict:
     thread_id = uuid4()
-    out = search(query=q, thread_id=thread_id)
+    out = await _search(request, q, thread_id)
+    grouped = out["documents"]
+    request.app.state.sessions.put(thread_id, q, grouped.ids, out["key"])
+    end = _page_end(len(grouped), offset, limit)
+    documents = [grouped.document(docid) for docid in range(offset, end)]
+    return _page(thread_id, q, len(grouped), offset, documents, fields)
+
+
+@app.get("/query/{thread_id}")
+async def query_page(
+    request: Request,
+    thread_id: UUID,
+    offset: int = Query(0, ge=0),
+    limit: int | None = Query(None, gt=0),
+    fields: list[Field] | None = Query(None),
+) -> dict:
+    session = request.app.state.sessions.get(thread_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired thread_id")
+    total = len(session["ids"])
+    end = _page_end(total, offset, limit)
+    q, documents = await _session_documents(
+        request, thread_id, list(range(offset, end))
+    )
+    return _page(thread_id, q, total, offset, documents, fields)
+
 
-    docs_dict = [d.dict() for d in out["documents"]]
-    document_store[thread_id] = docs_dict
-    query_mapping[thread_id] = q
-    return {"thread_id": thread_id, "query": q, "documents": docs_dict}
+@app.get("/document/{thread_id}")
+async def document(request: Request, thread_id: UUID, docid: int) -> dict:
+    _, [document] = await _session_documents(request, thread_id, [docid])
+    return _project(docid, document, None)
 
 
 @app.get("/explain/{thread_id}")
-async def explain(thread_id: UUID, docid: int) -> dict:
-    doc_dict = document_store[thread_id][docid]
-    document = Document(
-        page_content=doc_dict["page_content"],
-        metadata=doc_dict["metadata"],
-    )
-    query = query_mapping[thread_id]
-    out = generate(query=query, document=document, thread_id=thread_id)
-    out["document"] = doc_dict
+async def explain(request: Request, thread_id: UUID, docid: int) -> dict:
+    query, [document] = await _session_documents(request, thread_id, [docid])
+    out = await _generate(request, query, document, thread_id)
+    # the output may be shared with coalesced callers, so copy before editing
+    return out | {"document": document.dict()}
+
+
+@app.get("/explain/{thread_id}/stream")
+async def explain_stream(
+    request: Request, thread_id: UUID, docid: int
+) -> StreamingResponse:
+    query, [document] = await _session_documents(request, thread_id, [docid])
+
+    async def events():
+        yield _sse("document", document.dict())
+        async for event, data in astream_generate(
+            query=query,
+            document=document,
+            thread_id=thread_id,
+            graph=request.app.state.generation_graph,
+            cache=request.app.state.explanation_cache,
+        ):
+            yield _sse(event, data)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/explain/{thread_id}/batch")
+async def explain_batch(
+    request: Request, thread_id: UUID, docids: list[int] = Query()
+) -> StreamingResponse:
+    query, documents = await _session_documents(request, thread_id, docids)
+    semaphore = asyncio.Semaphore(cfg.api.explain_concurrency)
+
+    async def explain_one(docid, document):
+        async with semaphore:
+            try:
+                out = await _generate(request, query, document, thread_id)
+            except Exception as err:
+                return "error", {"docid": docid, "detail": str(err)}
+        return "explanation", {"docid": docid} | out | {"document": document.dict()}
+
+    async def events():
+        tasks = [
+            asyncio.create_task(explain_one(docid, document))
+            for docid, document in zip(docids, documents)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield _sse(*await task)
+        finally:
+            for task in tasks:
+                task.cancel()
+        yield _sse("done", {"count": len(tasks)})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def _page_end(total: int, offset: int, limit: int | None) -> int:
+    return total if limit is None else min(offset + limit, total)
+
+
+def _page(
+    thread_id: UUID,
+    q: str,
+    total: int,
+    offset: int,
+    documents: list[Document],
+    fields: list[str] | None,
+) -> dict:
+    end = offset + len(documents)
+    with STAGE_SECONDS.labels("serialise").time():
+        return {
+            "thread_id": thread_id,
+            "query": q,
+            "total": total,
+            "next_offset": end if end < total else None,
+            "documents": [
+                _project(offset + i, document, fields)
+                for i, document in enumerate(documents)
+            ],
+        }
+
+
+def _snippet(content: str) -> str:
+    if content.startswith("Dataset Title:"):
+        content = content.split("\n\n", maxsplit=1)[-1]
+    return content[: cfg.api.snippet_chars]
+
+
+def _project(docid: int, document: Document, fields: list[str] | None) -> dict:
+    if fields is None:
+        return {
+            "docid": docid,
+            "page_content": document.page_content,
+            "metadata": document.metadata,
+        }
+
+    projected = {
+        "docid": docid,
+        "metadata": {
+            k: document.metadata.get(k) for k in fields if k in METADATA_FIELDS
+        },
+    }
+    if "snippet" in fields:
+        projected["snippet"] = _snippet(document.page_content)
+    if "page_content" in fields:
+        projected["page_content"] = document.page_content
+    return projected
+
 
-    return out
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
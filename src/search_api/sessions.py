@@ -0,0 +1,48 @@
+from uuid import UUID
+
+from src.common.settings import cfg
+from src.model.cache import SQLiteCache, TieredCache, TTLCache, index_version
+
+
+class SessionStore:
+    """
+    Maps a search thread to its query and the ranked dataset ids it returned.
+
+    Only references are kept: the result cache key of the search, if it was
+    cached, and the index version it ran against. Document content is read
+    back from the result cache by position.
+    """
+
+    def __init__(self, cache: TieredCache) -> None:
+        self.cache = cache
+
+    def put(self, thread_id: UUID, query: str, ids: list[str], key: str | None) -> None:
+        self.cache.set(
+            str(thread_id),
+            {
+                "query": query,
+                "index_version": index_version.get(),
+                "key": key,
+                "ids": ids,
+            },
+        )
+
+    def get(self, thread_id: UUID) -> dict | None:
+        return self.cache.get(str(thread_id))
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return self.cache.stats()
+
+
+def create_session_store() -> SessionStore:
+    memory = TTLCache(maxsize=cfg.api.session_maxsize, ttl=cfg.api.session_ttl)
+    disk = None
+    if cfg.api.session_backend == "sqlite":
+        disk = SQLiteCache(
+            cfg.api.session_path,
+            table="sessions",
+            ttl=cfg.api.session_ttl,
+            maxsize=cfg.api.session_maxsize,
+        )
+        disk.purge()
+    return SessionStore(TieredCache(memory, disk))
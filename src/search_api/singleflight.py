@@ -0,0 +1,61 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight task.
+
+    Every caller awaits the same task, so its result or exception reaches all
+    of them; the key is released when the task finishes, so failures are not
+    cached. A caller that is cancelled only stops waiting; the task itself is
+    cancelled once no callers are left.
+    """
+
+    def __init__(self) -> None:
+        self.leaders = 0
+        self.coalesced = 0
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._release(key, t))
+        else:
+            self.coalesced += 1
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._tasks.get(key) is task and self._waiters[key] == 1:
+                # drop the key first so a new caller starts a fresh task
+                # instead of joining one that is being cancelled
+                del self._tasks[key]
+                del self._waiters[key]
+                task.cancel()
+            raise
+        finally:
+            if self._tasks.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _release(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+            del self._waiters[key]
+        if not task.cancelled():
+            # mark the exception as retrieved when every caller has gone
+            task.exception()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.coalesced,
+            "misses": self.leaders,
+            "size": len(self._tasks),
+        }